@@ -0,0 +1,84 @@
+"""Standalone benchmarks for the theatre API.
+
+Run them from the ``challenge`` directory, e.g. ``python -m benchmarks.overlap``.
+Every benchmark runs against a throwaway test database, so the development
+database is never touched.
+"""
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import django
+
+
+def setup(database=None):
+    """Configure Django and create a test database.
+
+    The default in-memory SQLite database can't be shared between the threads of a
+    live server, so benchmarks that serve HTTP pass a file path as ``database``.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'challenge.settings')
+    django.setup()
+    from django.db import connection
+    if database is not None:
+        connection.settings_dict['TEST']['NAME'] = database
+    connection.creation.create_test_db(verbosity=0)
+
+
+def start_server():
+    """Serve the project from a background thread, returning its base URL."""
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+    from django.core.wsgi import get_wsgi_application
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler, allow_reuse_address=False)
+    server.set_app(get_wsgi_application())
+    # Rejected purchases are expected under load, don't log every 400
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:{}'.format(server.server_port)
+
+
+def request(url, data=None, headers=None):
+    """Send a GET, or a JSON POST when ``data`` is given, returning (status, body)."""
+    headers = dict(headers or {})
+    body = None
+    if data is not None:
+        body = json.dumps(data).encode()
+        headers['Content-Type'] = 'application/json'
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, body, headers)) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as error:
+        return error.code, error.read()
+
+
+def timed(func, repeat=5):
+    """Return the median wall time of ``func()`` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def count_queries(func):
+    from django.db import connection
+    queries = []
+
+    def record(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(record):
+        func()
+    return len(queries)
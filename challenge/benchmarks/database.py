@@ -0,0 +1,33 @@
+"""Concurrent buyticket throughput under each database profile.
+
+    python -m benchmarks.database --clients 32 --capacity 500
+
+Runs ``benchmarks.purchase_load`` once per profile, in a fresh process since
+the profile is read when settings load. Profiles default to the SQLite ones;
+add ``postgres`` or ``pgbouncer`` when a server is configured.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('profiles', nargs='*', default=['sqlite', 'sqlite-wal'])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--capacity', type=int, default=500)
+    args = parser.parse_args()
+
+    status = 0
+    for profile in args.profiles:
+        print('== {}'.format(profile), flush=True)
+        command = [sys.executable, '-m', 'benchmarks.purchase_load',
+                   '--clients', str(args.clients), '--capacity', str(args.capacity)]
+        env = dict(os.environ, THEATRE_DATABASE=profile)
+        status = subprocess.call(command, env=env) or status
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
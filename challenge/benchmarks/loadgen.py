@@ -0,0 +1,252 @@
+"""Drive box-office traffic at the API and check nothing was oversold.
+
+    python -m benchmarks.loadgen --clients 32 --duration 30
+    python -m benchmarks.loadgen --mix buy=80,availability=20 --skew 1.5 --capacity 50
+    python -m benchmarks.loadgen --url http://127.0.0.1:8000 --requests 20000
+
+Rooms, movies and screenings are created through the API first, so the same
+run works against the server started here (WSGI by default, --asgi for uvicorn)
+or any running server given with --url. Clients then pick a request kind by
+the --mix weights and a movie by popularity: the movie ranked n is chosen with
+weight 1 / n ** skew, so a few hot movies sell out while the rest trickle.
+
+The report gives throughput and latency percentiles per kind, then compares
+the purchases that succeeded with each screening's capacity and with the
+seats the server reports sold.
+"""
+import argparse
+import collections
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import request, setup, start_server
+
+KINDS = ('list', 'availability', 'buy')
+SLOT_HOURS = 3
+FIRST_SLOT = 9
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError('unknown request kind {}, use {}'.format(kind, ', '.join(KINDS)))
+        try:
+            mix[kind] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError('weight for {} must be a number'.format(kind))
+    return mix
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def post(url, data):
+    status, body = request(url, data)
+    if status != 201:
+        raise SystemExit('POST {} failed with {}: {}'.format(url, status, body[:200]))
+    return json.loads(body.decode())
+
+
+def seed(base_url, rooms, movies, screenings_per_room, capacity):
+    """Create the catalog through the API, returning [(screening id, movie rank)]."""
+    if screenings_per_room * SLOT_HOURS > 24:
+        raise SystemExit('at most {} screenings fit in a room'.format(24 // SLOT_HOURS))
+    movie_ids = [post(base_url + '/movies/', {'title': 'loadgen {}'.format(rank), 'length': '02:00:00'})['id']
+                 for rank in range(movies)]
+    screenings = []
+    for room_number in range(rooms):
+        room = post(base_url + '/rooms/', {'capacity': capacity})['id']
+        for slot in range(screenings_per_room):
+            # Spread the movies over the rooms so every movie gets its share of screenings
+            rank = (room_number * screenings_per_room + slot) % movies
+            time_of_day = datetime.time(hour=(FIRST_SLOT + slot * SLOT_HOURS) % 24)
+            screening = post(base_url + '/screenings/', {'room': room, 'movie': movie_ids[rank],
+                                                         'time': str(time_of_day)})
+            screenings.append((screening['id'], rank))
+    return movie_ids, screenings
+
+
+class Traffic:
+    def __init__(self, base_url, movie_ids, screenings, dates, mix, skew):
+        self.base_url = base_url
+        self.movie_ids = movie_ids
+        self.dates = dates
+        self.kinds = list(mix)
+        self.kind_weights = [mix[kind] for kind in self.kinds]
+        self.movie_weights = [1 / (rank + 1) ** skew for rank in range(len(movie_ids))]
+        self.screenings_by_rank = collections.defaultdict(list)
+        for screening, rank in screenings:
+            self.screenings_by_rank[rank].append(screening)
+        self.lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.statuses = collections.defaultdict(collections.Counter)
+        # Successful purchases per (screening, date)
+        self.sold = collections.Counter()
+
+    def call(self, rng):
+        kind = rng.choices(self.kinds, self.kind_weights)[0]
+        rank = rng.choices(range(len(self.movie_ids)), self.movie_weights)[0]
+        date = rng.choice(self.dates)
+        screening = None
+        start = time.perf_counter()
+        if kind == 'list':
+            status, _ = request('{}/screenings/?page_size=100'.format(self.base_url))
+        elif kind == 'availability':
+            status, _ = request('{}/screenings/availability/?movie={}&start={}&end={}'.format(
+                self.base_url, self.movie_ids[rank], self.dates[0], self.dates[-1]))
+        else:
+            screening = rng.choice(self.screenings_by_rank[rank])
+            status, _ = request('{}/screenings/{}/buyticket/'.format(self.base_url, screening), {'date': str(date)})
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[kind].append(elapsed)
+            self.statuses[kind][status] += 1
+            # 202 is a ticket granted by a write-behind server
+            if kind == 'buy' and status in (200, 202):
+                self.sold[screening, date] += 1
+
+    def run(self, clients, requests, duration, random_seed):
+        deadline = time.perf_counter() + duration if duration else None
+        remaining = [requests]
+
+        def client(number):
+            rng = random.Random(random_seed + number)
+            while True:
+                with self.lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                self.call(rng)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(clients) as pool:
+            list(pool.map(client, range(clients)))
+        return time.perf_counter() - start
+
+
+def server_sold(base_url, screenings, dates, capacity):
+    """Seats sold per (screening, date) according to the availability endpoint."""
+    sold = {}
+    ids = [screening for screening, _ in screenings]
+    for offset in range(0, len(ids), 50):
+        query = '&'.join('screening={}'.format(screening) for screening in ids[offset:offset + 50])
+        status, body = request('{}/screenings/availability/?start={}&end={}&{}'.format(
+            base_url, dates[0], dates[-1], query))
+        if status != 200:
+            raise SystemExit('availability check failed with {}'.format(status))
+        for row in json.loads(body.decode()):
+            sold[row['screening'], datetime.date.fromisoformat(row['date'])] = capacity - row['remaining']
+    return sold
+
+
+def report(traffic, elapsed, sold_by_server, capacity):
+    total = sum(len(latencies) for latencies in traffic.latencies.values())
+    result = {'requests': total, 'seconds': elapsed, 'throughput': total / elapsed, 'kinds': {}}
+    print('{} requests in {:.1f}s, {:.1f} requests/s'.format(total, elapsed, total / elapsed))
+    print('{:<13} {:>8} {:>9} {:>8} {:>8} {:>8} {:>8}  statuses'.format(
+        'kind', 'count', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+    for kind in KINDS:
+        latencies = sorted(traffic.latencies.get(kind, []))
+        if not latencies:
+            continue
+        row = {
+            'count': len(latencies),
+            'throughput': len(latencies) / elapsed,
+            'p50': percentile(latencies, 0.5) * 1000,
+            'p95': percentile(latencies, 0.95) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'max': latencies[-1] * 1000,
+            'statuses': {str(status): count for status, count in sorted(traffic.statuses[kind].items())},
+        }
+        result['kinds'][kind] = row
+        print('{:<13} {count:>8} {throughput:>9.1f} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {max:>8.1f}  {}'.format(
+            kind, ' '.join('{}x{}'.format(count, status) for status, count in row['statuses'].items()), **row))
+
+    oversold = [key for key, count in traffic.sold.items() if count > capacity]
+    mismatched = [key for key in set(traffic.sold) | set(sold_by_server)
+                  if traffic.sold.get(key, 0) != sold_by_server.get(key, 0)]
+    sold_out = sum(1 for count in traffic.sold.values() if count == capacity)
+    result.update(tickets=sum(traffic.sold.values()), sold_out=sold_out, oversold=len(oversold),
+                  mismatched=len(mismatched))
+    print('{} tickets sold, {} screening dates sold out, {} oversold, {} with counters differing from sales'.format(
+        result['tickets'], sold_out, len(oversold), len(mismatched)))
+    if mismatched:
+        print('Counters differ from sales: another client is buying, or a write-behind server still holds '
+              'reserved seats')
+    return result
+
+
+def main(directory):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='base URL of a running server, instead of starting one here')
+    parser.add_argument('--asgi', action='store_true', help='serve the ASGI application with uvicorn')
+    parser.add_argument('--write-behind', action='store_true', help='grant tickets from the write-behind queue')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=5000, help='total requests, unless --duration ends first')
+    parser.add_argument('--duration', type=float, default=None, help='seconds to run for')
+    parser.add_argument('--mix', type=parse_mix, default='list=20,availability=30,buy=50',
+                        help='weights of each request kind, default list=20,availability=30,buy=50')
+    parser.add_argument('--skew', type=float, default=1.2, help='popularity skew, 0 for every movie alike')
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--movies', type=int, default=20)
+    parser.add_argument('--screenings-per-room', type=int, default=4)
+    parser.add_argument('--capacity', type=int, default=100)
+    parser.add_argument('--days', type=int, default=3, help='dates to sell, starting tomorrow, at most 31')
+    parser.add_argument('--seed', type=int, default=0, help='random seed, runs with the same seed match')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+    if not 0 < args.days <= 31:
+        parser.error('--days must be 1 to 31')
+
+    writebehind = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        setup(database=os.path.join(directory, 'loadgen.sqlite3'))
+        from django.conf import settings
+        from theatre import writebehind
+        settings.TICKET_WRITE_BEHIND = args.write_behind
+        settings.TICKET_JOURNAL_DIR = os.path.join(directory, 'journal')
+        if args.asgi:
+            from benchmarks.serving import start_asgi_server
+            base_url = start_asgi_server()[0]
+        else:
+            base_url = start_server()
+
+    movie_ids, screenings = seed(base_url, args.rooms, args.movies, args.screenings_per_room, args.capacity)
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    dates = [tomorrow + datetime.timedelta(days=day) for day in range(args.days)]
+    print('{} clients, {} screenings of {} movies, capacity {}, mix {}, skew {}'.format(
+        args.clients, len(screenings), len(movie_ids), args.capacity,
+        ','.join('{}={:g}'.format(kind, weight) for kind, weight in args.mix.items()), args.skew))
+
+    traffic = Traffic(base_url, movie_ids, screenings, dates, args.mix, args.skew)
+    elapsed = traffic.run(args.clients, args.requests, args.duration, args.seed)
+    if writebehind is not None:
+        # Write out the granted tickets and hand back unused seats before counting
+        writebehind.stop()
+    result = report(traffic, elapsed, server_sold(base_url, screenings, dates, args.capacity), args.capacity)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(dict(result, arguments={key: value for key, value in vars(args).items() if key != 'output'}),
+                      output, indent=2, sort_keys=True, default=str)
+    return 1 if result['oversold'] else 0
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        sys.exit(main(directory))
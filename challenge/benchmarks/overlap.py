@@ -0,0 +1,63 @@
+"""Compare the room-scoped overlap query against the old full-table loop.
+
+    python -m benchmarks.overlap
+"""
+import argparse
+import datetime
+
+from benchmarks import count_queries, setup, timed
+
+SCREENINGS_PER_ROOM = 8
+
+
+def legacy_overlap_exists(proposed_screening):
+    from theatre.models import Screening
+    # The check as it was before screenings stored their bounds: every screening in
+    # every room, with a lazy movie fetch per comparison.
+    for screening in Screening.objects.all():
+        if proposed_screening.overlaps(screening):
+            return True
+    return False
+
+
+def seed(rooms):
+    from theatre.models import Room, Movie, Screening
+    Screening.objects.all().delete()
+    Room.objects.all().delete()
+    movie = Movie.objects.create(title='benchmark', length=datetime.timedelta(minutes=90))
+    Room.objects.bulk_create(Room(capacity=100) for _ in range(rooms))
+    screenings = []
+    for room in Room.objects.all():
+        for hour in range(0, 24, 24 // SCREENINGS_PER_ROOM):
+            screening = Screening(room=room, movie=movie, time=datetime.time(hour=hour))
+            screening.start_offset, screening.end_offset = screening.bounds()
+            screenings.append(screening)
+    Screening.objects.bulk_create(screenings, batch_size=500)
+    short_movie = Movie.objects.create(title='short', length=datetime.timedelta(hours=1))
+    # Fits in the gap between the 00:00 and 03:00 screenings, so neither check can stop early
+    return Screening(room=Room.objects.first(), movie=short_movie, time=datetime.time(hour=1, minute=45))
+
+
+def main():
+    from theatre.views import overlap_exists
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rooms', type=int, nargs='+', default=[1, 10, 100, 500])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:>6} {:>11} {:>12} {:>9} {:>12} {:>9}'.format(
+        'rooms', 'screenings', 'legacy ms', 'queries', 'indexed ms', 'queries'))
+    for rooms in args.rooms:
+        proposed = seed(rooms)
+        assert not legacy_overlap_exists(proposed) and not overlap_exists(proposed)
+        print('{:>6} {:>11} {:>12.2f} {:>9} {:>12.3f} {:>9}'.format(
+            rooms, rooms * SCREENINGS_PER_ROOM,
+            timed(lambda: legacy_overlap_exists(proposed), args.repeat),
+            count_queries(lambda: legacy_overlap_exists(proposed)),
+            timed(lambda: overlap_exists(proposed), args.repeat),
+            count_queries(lambda: overlap_exists(proposed))))
+
+
+if __name__ == '__main__':
+    setup()
+    main()
@@ -0,0 +1,70 @@
+"""Hammer buyticket from concurrent clients and check nothing is oversold.
+
+    python -m benchmarks.purchase_load --capacity 200 --clients 16
+    python -m benchmarks.purchase_load --write-behind
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import request, setup, start_server
+
+
+def main(directory):
+    from django.conf import settings
+    from theatre import writebehind
+    from theatre.models import Room, Movie, Screening, Ticket, SeatInventory
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--capacity', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--attempts', type=int, default=None,
+                        help='total purchase attempts, defaults to twice the capacity')
+    parser.add_argument('--write-behind', action='store_true', help='grant tickets from the write-behind queue')
+    args = parser.parse_args()
+    settings.TICKET_WRITE_BEHIND = args.write_behind
+    settings.TICKET_JOURNAL_DIR = os.path.join(directory, 'journal')
+    attempts = args.attempts or args.capacity * 2
+
+    room = Room.objects.create(capacity=args.capacity)
+    movie = Movie.objects.create(title='benchmark')
+    screening = Screening.objects.create(room=room, movie=movie, time=datetime.time(hour=12))
+    date = datetime.date.today() + datetime.timedelta(days=1)
+    url = '{}/screenings/{}/buyticket/'.format(start_server(), screening.pk)
+
+    outcomes = {'sold': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def buy(_):
+        status, _ = request(url, {'date': str(date)})
+        outcome = 'sold' if status in (200, 202) else 'rejected' if status == 400 else 'errors'
+        with lock:
+            outcomes[outcome] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as pool:
+        list(pool.map(buy, range(attempts)))
+    elapsed = time.perf_counter() - start
+    # Write out everything the queue granted before counting
+    writebehind.stop()
+
+    tickets = Ticket.objects.filter(screening=screening, date=date).count()
+    inventory = SeatInventory.objects.get(screening=screening, date=date).sold
+    print('clients {}, attempts {}, capacity {}'.format(args.clients, attempts, args.capacity))
+    print('sold {sold}, rejected {rejected}, errors {errors}'.format(**outcomes))
+    print('{:.1f} requests/s, {:.1f} purchases/s'.format(attempts / elapsed, outcomes['sold'] / elapsed))
+    print('tickets in database {}, inventory counter {}'.format(tickets, inventory))
+    if tickets > args.capacity or tickets != outcomes['sold'] or inventory != tickets:
+        print('OVERSOLD or inconsistent inventory')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        setup(database=os.path.join(directory, 'benchmark.sqlite3'))
+        sys.exit(main(directory))
@@ -0,0 +1,60 @@
+"""Compare the ModelSerializers against ValuesSerializer on large lists.
+
+    python -m benchmarks.serializers --rows 10000
+"""
+import argparse
+import datetime
+
+from benchmarks import setup, timed
+
+
+def seed(rows):
+    from theatre.models import Room, Movie, Screening, Ticket
+    Room.objects.bulk_create((Room(capacity=100) for _ in range(rows)), batch_size=500)
+    Movie.objects.bulk_create((Movie(title='movie {}'.format(number),
+                                     length=datetime.timedelta(minutes=90 + number % 60))
+                               for number in range(rows)), batch_size=500)
+    room, movie = Room.objects.first(), Movie.objects.first()
+    screenings = []
+    for number in range(rows):
+        screening = Screening(room=room, movie=movie, time=datetime.time(hour=number % 24, minute=number % 60))
+        screening.start_offset, screening.end_offset = screening.bounds()
+        screenings.append(screening)
+    Screening.objects.bulk_create(screenings, batch_size=500)
+    screening = Screening.objects.first()
+    date = datetime.date.today()
+    Ticket.objects.bulk_create((Ticket(screening=screening, date=date) for _ in range(rows)), batch_size=500)
+
+
+def main():
+    from theatre.models import Room, Movie, Screening, Ticket
+    from theatre.serializers import RoomSerializer, MovieSerializer, ScreeningSerializer, TicketSerializer, \
+        ValuesSerializer
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    seed(args.rows)
+
+    print('{:<12} {:>14} {:>14} {:>9} {:>14} {:>14} {:>9}'.format(
+        'serializer', 'model ms', 'values ms', 'speedup', 'model+db ms', 'values+db ms', 'speedup'))
+    for model, serializer_class in ((Room, RoomSerializer), (Movie, MovieSerializer),
+                                    (Screening, ScreeningSerializer), (Ticket, TicketSerializer)):
+        queryset = model.objects.order_by('pk')
+        fast = ValuesSerializer(serializer_class)
+        instances = list(queryset)
+        rows = list(fast.rows(queryset))
+        # Rows are converted in place, so every run gets fresh copies, copied outside the timing
+        copies = [[dict(row) for row in rows] for _ in range(args.repeat)]
+        model_only = timed(lambda: serializer_class(instances, many=True).data, args.repeat)
+        values_only = timed(lambda: fast.to_representation(copies.pop()), args.repeat)
+        model_total = timed(lambda: serializer_class(list(queryset), many=True).data, args.repeat)
+        values_total = timed(lambda: fast.to_representation(list(fast.rows(queryset))), args.repeat)
+        print('{:<12} {:>14.1f} {:>14.1f} {:>8.1f}x {:>14.1f} {:>14.1f} {:>8.1f}x'.format(
+            model.__name__, model_only, values_only, model_only / values_only,
+            model_total, values_total, model_total / values_total))
+
+
+if __name__ == '__main__':
+    setup()
+    main()
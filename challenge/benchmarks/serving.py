@@ -0,0 +1,106 @@
+"""Compare WSGI and ASGI serving of buyticket and availability under load.
+
+    python -m benchmarks.serving --clients 64 --requests 2000
+
+Both servers run in this process against the same database; the ASGI run needs
+uvicorn (``pip install uvicorn``). Every client alternates purchases with
+availability reads, and the report gives throughput and p50/p99 latency.
+"""
+import argparse
+import datetime
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import request, setup, start_server
+
+
+def start_asgi_server():
+    """Serve the ASGI application with uvicorn from a background thread."""
+    import uvicorn
+    from theatre.asgi import TheatreApplication
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    config = uvicorn.Config(TheatreApplication(), log_level='error', access_log=False)
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return 'http://127.0.0.1:{}'.format(sock.getsockname()[1]), server
+
+
+def run_load(base_url, screening, date, clients, total):
+    buy_url = '{}/screenings/{}/buyticket/'.format(base_url, screening.pk)
+    availability_url = '{}/screenings/availability/?start={}&end={}&screening={}'.format(
+        base_url, date, date, screening.pk)
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def call(index):
+        start = time.perf_counter()
+        if index % 2:
+            status, _ = request(availability_url)
+        else:
+            status, _ = request(buy_url, {'date': str(date)})
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if status not in (200, 400):
+                failures.append(status)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(call, range(total)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'throughput': total / elapsed,
+        'p50': latencies[len(latencies) // 2] * 1000,
+        'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        'failures': len(failures),
+    }
+
+
+def main():
+    from theatre.models import Room, Movie, Screening, Ticket
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--capacity', type=int, default=500)
+    args = parser.parse_args()
+
+    movie = Movie.objects.create(title='benchmark')
+    date = datetime.date.today() + datetime.timedelta(days=1)
+
+    servers = [('wsgi', start_server)]
+    try:
+        import uvicorn  # noqa: F401
+        servers.append(('asgi', lambda: start_asgi_server()[0]))
+    except ImportError:
+        print('uvicorn is not installed, skipping the ASGI run (pip install uvicorn)')
+
+    print('clients {}, requests {}, capacity {}'.format(args.clients, args.requests, args.capacity))
+    status = 0
+    for name, start in servers:
+        # A fresh room per run so both servers sell into an empty screening
+        room = Room.objects.create(capacity=args.capacity)
+        screening = Screening.objects.create(room=room, movie=movie, time=datetime.time(hour=12))
+        result = run_load(start(), screening, date, args.clients, args.requests)
+        sold = Ticket.objects.filter(screening=screening, date=date).count()
+        print('{}: {throughput:.1f} requests/s, p50 {p50:.1f}ms, p99 {p99:.1f}ms, '
+              '{failures} failures, {sold} sold'.format(name, sold=sold, **result))
+        if result['failures'] or sold > args.capacity:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        setup(database=os.path.join(directory, 'benchmark.sqlite3'))
+        sys.exit(main())
@@ -0,0 +1,90 @@
+"""Compare worker startup and per-request overhead of the settings profiles.
+
+    python -m benchmarks.startup --starts 5 --requests 2000
+
+Each start is a fresh interpreter that sets Django up and loads the WSGI
+application and URLs, the work a new worker does before its first request.
+Requests are then sent straight to the WSGI handler, without a server, so
+the time is Django's own: middleware, routing, the view and rendering.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROFILES = ['challenge.settings', 'challenge.settings_api']
+PATHS = ['/rooms/{room}/', '/screenings/availability/']
+
+
+def child(requests):
+    start = time.perf_counter()
+    import django
+    django.setup()
+    from django.core.wsgi import get_wsgi_application
+    from django.urls import get_resolver
+    application = get_wsgi_application()
+    get_resolver().url_patterns
+    startup = time.perf_counter() - start
+    modules = len(sys.modules)
+
+    from django.db import connection
+    from django.test import RequestFactory
+    connection.creation.create_test_db(verbosity=0)
+    from theatre.models import Room
+    room = Room.objects.create(capacity=100)
+    factory = RequestFactory()
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    per_request = {}
+    for path in PATHS:
+        path = path.format(room=room.pk)
+        environs = [factory.get(path).environ for _ in range(requests + 1)]
+        # The first request pays for lazy imports and an empty cache
+        b''.join(application(environs.pop(), start_response))
+        begin = time.perf_counter()
+        for environ in environs:
+            b''.join(application(environ, start_response))
+        per_request[path] = (time.perf_counter() - begin) / requests
+    print(json.dumps({'startup': startup, 'modules': modules, 'per_request': per_request}))
+
+
+def measure(profile, starts, requests):
+    runs = []
+    for _ in range(starts):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.startup', '--child', '--requests', str(requests)],
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE=profile), check=True, stdout=subprocess.PIPE,
+            universal_newlines=True).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    return {
+        'startup': statistics.median(run['startup'] for run in runs),
+        'modules': runs[0]['modules'],
+        'per_request': {path: statistics.median(run['per_request'][path] for run in runs)
+                        for path in runs[0]['per_request']},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--starts', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.requests)
+
+    for profile in PROFILES:
+        result = measure(profile, args.starts, args.requests)
+        print(profile)
+        print('  startup {:.1f} ms, {} modules loaded'.format(result['startup'] * 1000, result['modules']))
+        for path, seconds in result['per_request'].items():
+            print('  GET {:<28} {:.3f} ms/request'.format(path, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
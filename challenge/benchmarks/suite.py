@@ -0,0 +1,176 @@
+"""Time the hot endpoints against a large seeded dataset and report JSON.
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --tickets 100000 --compare results.json
+
+Requests go through the full Django stack in-process, without a network hop.
+Each scenario records median, p95 and best wall time along with the queries
+the request ran. --compare prints the change in median against a saved run.
+"""
+import argparse
+import datetime
+import json
+import logging
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import django
+
+from benchmarks import setup
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+class Scenario:
+    def __init__(self, name, method, path, data=None, expect=200, cached=False, cleanup=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.expect = expect
+        self.cached = cached
+        self.cleanup = cleanup
+
+    def run(self, client, repeat):
+        from django.core.cache import cache
+        samples = []
+        queries = None
+        for iteration in range(repeat):
+            if not self.cached:
+                cache.clear()
+            path = self.path(iteration) if callable(self.path) else self.path
+            data = self.data(iteration) if callable(self.data) else self.data
+            start = time.perf_counter()
+            response = getattr(client, self.method)(path, data, format='json')
+            samples.append(time.perf_counter() - start)
+            if response.status_code != self.expect:
+                raise RuntimeError('{} returned {}, expected {}: {}'.format(
+                    self.name, response.status_code, self.expect, response.content[:200]))
+            queries = int(SERVER_TIMING_QUERIES.search(response['Server-Timing']).group(1))
+            if self.cleanup:
+                self.cleanup(response)
+        samples.sort()
+        return {
+            'median_ms': round(statistics.median(samples) * 1000, 3),
+            'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+            'min_ms': round(samples[0] * 1000, 3),
+            'queries': queries,
+            'repeat': repeat,
+        }
+
+
+def scenarios(start, repeat):
+    from theatre.models import Room, Movie, Screening
+    room = Room.objects.order_by('pk').first()
+    first = Screening.objects.filter(room=room).select_related('movie').order_by('start_offset').first()
+    gap = (datetime.datetime.combine(start, first.time) + first.movie.length).time()
+    short = Movie.objects.create(title='benchmark short', length=datetime.timedelta(minutes=1))
+    # Purchases rotate over screenings so none of them sells out
+    screenings = list(Screening.objects.order_by('pk').values_list('pk', flat=True)[:repeat])
+    beyond = start + datetime.timedelta(days=3650)
+
+    def delete_created(response):
+        Screening.objects.filter(pk=response.data['id']).delete()
+
+    return [
+        Scenario('screening_create', 'post', '/screenings/',
+                 {'room': room.pk, 'movie': short.pk, 'time': str(gap)}, 201, cleanup=delete_created),
+        Scenario('screening_create_overlap', 'post', '/screenings/',
+                 {'room': room.pk, 'movie': short.pk, 'time': str(first.time)}, 400),
+        Scenario('ticket_purchase', 'post',
+                 lambda i: '/screenings/{}/buyticket/'.format(screenings[i % len(screenings)]),
+                 {'date': str(start)}),
+        Scenario('ticket_purchase_first_of_day', 'post',
+                 lambda i: '/screenings/{}/buyticket/'.format(screenings[i % len(screenings)]),
+                 {'date': str(beyond)}),
+        Scenario('ticket_purchase_bulk', 'post', '/screenings/buytickets/',
+                 lambda i: {'items': [{'screening': screenings[i % len(screenings)], 'date': str(start),
+                                       'quantity': 5}]}),
+        Scenario('room_list', 'get', '/rooms/'),
+        Scenario('movie_list', 'get', '/movies/'),
+        Scenario('screening_list', 'get', '/screenings/'),
+        Scenario('screening_list_cached', 'get', '/screenings/', cached=True),
+        Scenario('screening_list_expanded', 'get', '/screenings/?expand=1'),
+        Scenario('screening_list_1000', 'get', '/screenings/?page_size=1000'),
+        Scenario('room_schedule', 'get', '/rooms/{}/schedule/'.format(room.pk)),
+        Scenario('availability_day', 'get', '/screenings/availability/?start={0}&end={0}'.format(start)),
+        Scenario('availability_room_week', 'get', '/screenings/availability/?start={}&end={}&room={}'.format(
+            start, start + datetime.timedelta(days=6), room.pk)),
+    ]
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results):
+    print('{:<30} {:>12} {:>12} {:>8}'.format('scenario', 'before ms', 'after ms', 'change'), file=sys.stderr)
+    for name, result in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            print('{:<30} {:>12} {:>12.3f}'.format(name, '-', result['median_ms']), file=sys.stderr)
+            continue
+        change = (result['median_ms'] - before['median_ms']) / before['median_ms'] * 100
+        print('{:<30} {:>12.3f} {:>12.3f} {:>+7.1f}%'.format(
+            name, before['median_ms'], result['median_ms'], change), file=sys.stderr)
+
+
+def main():
+    from rest_framework.test import APIClient
+    from theatre.seed import seed
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=500)
+    parser.add_argument('--screenings', type=int, default=10000)
+    parser.add_argument('--movies', type=int, default=200)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--tickets', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--only', nargs='+', help='scenario names to run')
+    parser.add_argument('--output', help='file to write the JSON results to, instead of standard output')
+    parser.add_argument('--compare', help='earlier JSON results to compare medians against')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    dataset = seed(rooms=args.rooms, screenings=args.screenings, movies=args.movies,
+                   days=args.days, tickets=args.tickets)
+    dataset['seed_seconds'] = round(time.perf_counter() - started, 1)
+    start = datetime.date.today() + datetime.timedelta(days=1)
+
+    # The overlap scenario is rejected on purpose, don't log every 400
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+    client = APIClient()
+    results = {
+        'commit': current_commit(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'dataset': dataset,
+        'scenarios': {},
+    }
+    for scenario in scenarios(start, args.repeat):
+        if args.only and scenario.name not in args.only:
+            continue
+        results['scenarios'][scenario.name] = scenario.run(client, args.repeat)
+        print('{:<30} {median_ms:>10.3f} ms {queries:>4} queries'.format(
+            scenario.name, **results['scenarios'][scenario.name]), file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(json.load(baseline), results)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    setup()
+    main()
@@ -0,0 +1,96 @@
+"""Time the ticket/screening index migration and the lookups it speeds up.
+
+    python -m benchmarks.ticket_index --screenings 200 --days 60 --tickets 25
+"""
+import argparse
+import datetime
+import time
+
+from benchmarks import setup, timed
+
+BEFORE = '0004_seat_inventory'
+AFTER = '0005_ticket_screening_date_index'
+
+
+def migrate(target):
+    from django.core.management import call_command
+    call_command('migrate', 'theatre', target, verbosity=0)
+
+
+def historical_apps(target):
+    """The app registry as of a migration, later columns don't exist in the database yet."""
+    from django.db import connection
+    from django.db.migrations.executor import MigrationExecutor
+    return MigrationExecutor(connection).loader.project_state(('theatre', target)).apps
+
+
+def seed(apps, screenings, days, tickets_per_day):
+    from theatre.models import seconds_since_midnight
+    Room, Movie, Screening, Ticket = (apps.get_model('theatre', name)
+                                      for name in ('Room', 'Movie', 'Screening', 'Ticket'))
+    movie = Movie.objects.create(title='benchmark', length=datetime.timedelta(minutes=50))
+    rooms = -(-screenings // 24)
+    Room.objects.bulk_create(Room(capacity=tickets_per_day) for _ in range(rooms))
+    batch = []
+    for room in Room.objects.all():
+        for hour in range(24):
+            if len(batch) < screenings:
+                # Historical models don't have Screening.bounds()
+                start_offset = seconds_since_midnight(datetime.time(hour=hour))
+                batch.append(Screening(room=room, movie=movie, time=datetime.time(hour=hour),
+                                       start_offset=start_offset,
+                                       end_offset=start_offset + int(movie.length.total_seconds())))
+    Screening.objects.bulk_create(batch)
+    start = datetime.date(2030, 1, 1)
+    # Tickets are written directly; the inventory counters don't matter here
+    for screening in Screening.objects.values_list('pk', flat=True):
+        Ticket.objects.bulk_create(
+            (Ticket(screening_id=screening, date=start + datetime.timedelta(days=day))
+             for day in range(days) for _ in range(tickets_per_day)))
+    return Screening.objects.order_by('pk').last().pk, start + datetime.timedelta(days=days // 2)
+
+
+def query_plan(queryset):
+    from django.db import connection
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return '; '.join(row[-1] for row in cursor.fetchall())
+
+
+def measure(apps, screening, date, repeat):
+    Screening, Ticket = apps.get_model('theatre', 'Screening'), apps.get_model('theatre', 'Ticket')
+    tickets = Ticket.objects.filter(screening=screening, date=date)
+    window = Screening.objects.filter(time__range=(datetime.time(hour=12), datetime.time(hour=13)))
+    return [
+        ('tickets for (screening, date)', timed(tickets.count, repeat), query_plan(tickets.values('pk'))),
+        ('screenings in time window', timed(lambda: list(window.all()), repeat), query_plan(window)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--screenings', type=int, default=200)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--tickets', type=int, default=25, help='tickets per screening per day')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    migrate(BEFORE)
+    apps = historical_apps(BEFORE)
+    screening, date = seed(apps, args.screenings, args.days, args.tickets)
+    print('{} tickets'.format(apps.get_model('theatre', 'Ticket').objects.count()))
+    before = measure(apps, screening, date, args.repeat)
+    start = time.perf_counter()
+    migrate(AFTER)
+    print('migration {} took {:.0f} ms'.format(AFTER, (time.perf_counter() - start) * 1000))
+    after = measure(historical_apps(AFTER), screening, date, args.repeat)
+    for (name, before_ms, before_plan), (_, after_ms, after_plan) in zip(before, after):
+        print('{}: {:.3f} ms -> {:.3f} ms'.format(name, before_ms, after_ms))
+        print('    before: {}'.format(before_plan))
+        print('    after:  {}'.format(after_plan))
+
+
+if __name__ == '__main__':
+    setup()
+    main()
@@ -0,0 +1,19 @@
+"""
+ASGI config for challenge project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with any ASGI server, e.g. ``uvicorn challenge.asgi:application``.
+Ticket purchases and availability reads are handled asynchronously, everything
+else goes through the WSGI application in ``challenge/wsgi.py``.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'challenge.settings')
+django.setup()
+
+from theatre.asgi import TheatreApplication  # noqa: E402
+
+application = TheatreApplication()
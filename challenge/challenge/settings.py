@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -42,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'theatre.metrics.MetricsMiddleware',
+    'theatre.idempotency.IdempotencyMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,6 +79,16 @@ WSGI_APPLICATION = 'challenge.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# THEATRE_DATABASE selects a profile:
+#   sqlite     - plain SQLite, a new connection per request (the default)
+#   sqlite-wal - SQLite in WAL mode so readers don't block the writer, with a
+#                busy timeout instead of immediate "database is locked" errors
+#   postgres   - PostgreSQL (needs psycopg2), configured by THEATRE_DB_* variables
+#   pgbouncer  - PostgreSQL behind a PgBouncer transaction pool
+# The tuned profiles keep connections open for THEATRE_CONN_MAX_AGE seconds.
+
+DATABASE_PROFILE = os.environ.get('THEATRE_DATABASE', 'sqlite')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
@@ -82,6 +96,80 @@ DATABASES = {
     }
 }
 
+# Applied to every new SQLite connection, see theatre.signals
+SQLITE_PRAGMAS = {}
+
+if DATABASE_PROFILE == 'sqlite-wal':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.environ.get('THEATRE_CONN_MAX_AGE', 60)),
+        'OPTIONS': {'timeout': 20},
+    })
+    SQLITE_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}
+elif DATABASE_PROFILE in ('postgres', 'pgbouncer'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('THEATRE_DB_NAME', 'theatre'),
+        'USER': os.environ.get('THEATRE_DB_USER', ''),
+        'PASSWORD': os.environ.get('THEATRE_DB_PASSWORD', ''),
+        'HOST': os.environ.get('THEATRE_DB_HOST', ''),
+        'PORT': os.environ.get('THEATRE_DB_PORT', ''),
+        'CONN_MAX_AGE': int(os.environ.get('THEATRE_CONN_MAX_AGE', 60)),
+    }
+    if DATABASE_PROFILE == 'pgbouncer':
+        # Server-side cursors don't survive transaction pooling
+        DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+elif DATABASE_PROFILE != 'sqlite':
+    raise ImproperlyConfigured('Unknown THEATRE_DATABASE profile {}'.format(DATABASE_PROFILE))
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# Local memory by default, or a directory shared by every worker process when
+# THEATRE_CACHE_DIR is set. 'idempotency' keeps responses to replay for retried
+# purchases, see theatre.idempotency. It has to be shared by every worker and claim
+# keys atomically, so it is a database table (manage.py createcachetable) or memcached.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'theatre_idempotency',
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+if os.environ.get('THEATRE_CACHE_DIR'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['THEATRE_CACHE_DIR'],
+    }
+
+
+# Write-behind ticket sales, see theatre.writebehind. Off unless THEATRE_WRITE_BEHIND=1.
+# Granted tickets are journaled to THEATRE_JOURNAL_DIR until they are written.
+
+TICKET_WRITE_BEHIND = os.environ.get('THEATRE_WRITE_BEHIND') == '1'
+TICKET_JOURNAL_DIR = os.environ.get('THEATRE_JOURNAL_DIR', os.path.join(BASE_DIR, 'journal'))
+TICKET_WRITE_BEHIND_OPTIONS = {
+    # Seats claimed from the inventory at a time, at most this many per screening
+    # and date can be left unsold if the process crashes
+    'block_size': 20,
+    'batch_size': 500,
+    'interval': 0.05,
+}
+
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'theatre.pagination.IdCursorPagination',
+    'PAGE_SIZE': 100,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
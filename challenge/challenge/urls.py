@@ -15,13 +15,17 @@ Including another URLconf
 """
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from theatre import views
+from theatre import metrics, views
 
 router = DefaultRouter()
 router.register(r'rooms', views.RoomViewSet)
 router.register(r'movies', views.MovieViewSet)
 router.register(r'screenings', views.ScreeningViewSet)
+router.register(r'tickets', views.TicketViewSet)
+router.register(r'holds', views.HoldViewSet)
+router.register(r'reports', views.ReportViewSet, basename='report')
 
 urlpatterns = [
+    path('metrics/', metrics.metrics, name='metrics'),
     path('', include(router.urls)),
 ]
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class TheatreConfig(AppConfig):
     name = 'theatre'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,158 @@
+"""Asynchronous serving for ticket purchases and availability reads.
+
+Django 2.2 has neither an ASGI handler nor async views, so this application
+answers those two endpoints itself on the event loop, off-loading only their
+database work to a thread pool, and hands every other request to the regular
+WSGI application. One process can then hold many connections open during an
+on-sale spike without a worker thread parked on each of them.
+"""
+import json
+import re
+
+from asgiref.sync import SyncToAsync
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
+from django.db import close_old_connections
+from django.http import QueryDict
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import idempotency, writebehind
+from .metrics import Timings, collect, registry
+from .models import Screening
+from .serializers import AvailabilityQuerySerializer
+from .views import requested_date, purchase_ticket, sold_ticket, screening_availability
+
+BUY_TICKET = re.compile(r'^/screenings/(?P<pk>[^/.]+)/buyticket/$')
+AVAILABILITY = re.compile(r'^/screenings/availability/$')
+NOT_FOUND = {'detail': 'Not found.'}
+
+
+def database_sync_to_async(func, timings):
+    # Run func in the thread pool, opening and closing connections as a request
+    # would and recording its queries and serialization in timings
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            with collect(timings):
+                return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return SyncToAsync(run, thread_sensitive=False)
+
+
+def render(status, payload):
+    if isinstance(payload, str):
+        return status, 'text/html; charset=utf-8', payload.encode()
+    return status, 'application/json', json.dumps(payload, cls=JSONEncoder).encode()
+
+
+def header(scope, name):
+    value = dict(scope['headers']).get(name)
+    return None if value is None else value.decode('latin-1')
+
+
+def parse_body(scope, body):
+    if (header(scope, b'content-type') or '').startswith('application/json'):
+        return json.loads(body.decode() or '{}')
+    return QueryDict(body)
+
+
+def sell_ticket(pk, scope, body):
+    try:
+        data = parse_body(scope, body)
+    except (UnicodeDecodeError, ValueError):
+        return render(400, {'detail': 'Malformed request body.'})
+    if not isinstance(data, dict):
+        data = {}
+    try:
+        date = requested_date(data)
+    except (TypeError, ValueError):
+        return render(400, "Improper format for requested date")
+    try:
+        screening = Screening.objects.select_related('room', 'rule').get(pk=pk)
+    except (Screening.DoesNotExist, ValueError):
+        return render(404, NOT_FOUND)
+    ticket = purchase_ticket(screening, date)
+    if ticket is None:
+        return render(400, "Unable to purchase ticket for specified screening")
+    return render(*sold_ticket(ticket))
+
+
+def buy_ticket(pk, scope, body):
+    # Honour Idempotency-Key like IdempotencyMiddleware does for the WSGI route
+    key = header(scope, b'idempotency-key')
+    if key is None:
+        return sell_ticket(pk, scope, body) + (False,)
+    return idempotency.run_once('POST', scope['path'], key, body, lambda: sell_ticket(pk, scope, body))
+
+
+def availability(query_string):
+    serializer = AvailabilityQuerySerializer(data=QueryDict(query_string))
+    if not serializer.is_valid():
+        return render(400, serializer.errors)
+    return render(200, screening_availability(Screening.objects.all(), serializer.validated_data))
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def respond(send, status, content_type, content, timings, replayed=False):
+    headers = [
+        (b'content-type', content_type.encode()),
+        (b'content-length', str(len(content)).encode()),
+        (b'server-timing', timings.server_timing().encode()),
+    ]
+    if replayed:
+        headers.append((idempotency.REPLAYED_HEADER.lower().encode(), b'true'))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': content})
+
+
+class TheatreApplication:
+    def __init__(self):
+        self.wsgi = WsgiToAsgi(get_wsgi_application())
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http':
+            match = BUY_TICKET.match(scope['path'])
+            if match and scope['method'] == 'POST':
+                return await self.buy_ticket(match.group('pk'), scope, receive, send)
+            if AVAILABILITY.match(scope['path']) and scope['method'] == 'GET':
+                return await self.availability(scope, send)
+        await self.wsgi(scope, receive, send)
+
+    async def buy_ticket(self, pk, scope, receive, send):
+        # Same view name as the WSGI route, so both modes share histograms
+        timings = Timings()
+        body = await read_body(receive)
+        *response, replayed = await database_sync_to_async(buy_ticket, timings)(pk, scope, body)
+        await self.finish('screening-buyticket', scope, send, response, timings, replayed)
+
+    async def availability(self, scope, send):
+        timings = Timings()
+        response = await database_sync_to_async(availability, timings)(scope['query_string'].decode())
+        await self.finish('screening-availability', scope, send, response, timings)
+
+    async def finish(self, view, scope, send, response, timings, replayed=False):
+        timings.finish()
+        registry.observe(view, scope['method'], timings)
+        await respond(send, *response, timings, replayed)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Write out tickets granted by the write-behind queue
+                await SyncToAsync(writebehind.stop, thread_sensitive=False)()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+CACHE_TIMEOUT = 60 * 60
+
+# Payloads that embed other models, e.g. expanded screenings inline their room and movie
+DEPENDENT_NAMESPACES = {
+    'rooms': ['screenings'],
+    'movies': ['screenings'],
+    'screenings': [],
+}
+
+
+def generation_key(namespace):
+    return 'theatre:generation:{}'.format(namespace)
+
+
+def new_generation():
+    # Not cached yet, or evicted. Payloads cached under earlier generations may still
+    # be there, so start above any of them rather than over from 1.
+    return time.time_ns()
+
+
+def generation(namespace):
+    return cache.get_or_set(generation_key(namespace), new_generation, None)
+
+
+def bump(namespaces):
+    for namespace in namespaces:
+        try:
+            cache.incr(generation_key(namespace))
+        except ValueError:
+            cache.set(generation_key(namespace), new_generation(), None)
+
+
+def invalidate(namespace):
+    namespaces = [namespace] + DEPENDENT_NAMESPACES[namespace]
+    bump(namespaces)
+    # Bump again once the write is visible, in case a read in the meantime cached
+    # the old rows under the new generation
+    transaction.on_commit(lambda: bump(namespaces))
+
+
+class CachedResponseMixin:
+    """Serve list and detail GETs from the cache.
+
+    Payloads are stored with an ETag under the namespace's current generation, and
+    writes bump the generation (see theatre.signals) rather than hunting down keys.
+    """
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, view, request, *args, **kwargs):
+        digest = hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()
+        key = 'theatre:{}:{}:{}'.format(self.cache_namespace, generation(self.cache_namespace), digest)
+        entry = cache.get(key)
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            payload = json.dumps(response.data, cls=JSONEncoder, sort_keys=True).encode()
+            entry = ('"{}"'.format(hashlib.sha1(payload).hexdigest()), response.data)
+            cache.set(key, entry, CACHE_TIMEOUT)
+        etag, data = entry
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response(data, headers={'ETag': etag})
@@ -0,0 +1,237 @@
+import collections
+import datetime
+
+from django.db import transaction, IntegrityError
+from django.utils.dateparse import parse_duration, parse_time
+from django.utils.duration import duration_string
+
+from .cache import invalidate
+from .formats import read_records, write_records, RecordError
+from .models import Room, Movie, Screening, ScreeningRule, RoomSchedule, SECONDS_PER_DAY, EVERY_DAY, \
+    seconds_since_midnight, shift_run, runs_share_date, weekday_bits
+
+KINDS = ('rooms', 'movies', 'screenings')
+BATCH_SIZE = 500
+MAX_ERRORS = 100
+# The largest value an integer column takes, ids and capacities included
+MAX_INTEGER = 2 ** 31 - 1
+# Screenings store where their movie ends, up to a day after they start, as an integer
+MAX_LENGTH = datetime.timedelta(seconds=MAX_INTEGER - SECONDS_PER_DAY)
+
+
+class CatalogError(Exception):
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def chunked(items, size=BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def parse_id(value, name):
+    if value in (None, ''):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise RecordError("{} must be an integer".format(name))
+    if not 1 <= value <= MAX_INTEGER:
+        raise RecordError("{} must be from 1 to {}".format(name, MAX_INTEGER))
+    return value
+
+
+def parse_room(record):
+    capacity = record.get('capacity')
+    if capacity in (None, ''):
+        capacity = Room._meta.get_field('capacity').default
+    try:
+        capacity = int(capacity)
+    except (TypeError, ValueError):
+        raise RecordError("capacity must be an integer")
+    if not 0 <= capacity <= MAX_INTEGER:
+        raise RecordError("capacity must be from 0 to {}".format(MAX_INTEGER))
+    return Room(pk=parse_id(record.get('id'), 'id'), capacity=capacity)
+
+
+def parse_movie(record):
+    title = record.get('title')
+    if not title or not isinstance(title, str):
+        raise RecordError("title is required")
+    if len(title) > Movie._meta.get_field('title').max_length:
+        raise RecordError("title is too long")
+    length = record.get('length')
+    if length in (None, ''):
+        length = Movie._meta.get_field('length').default
+    else:
+        out_of_range = RecordError("length must be from 00:00:00 to {}".format(duration_string(MAX_LENGTH)))
+        try:
+            length = parse_duration(str(length))
+        except OverflowError:
+            raise out_of_range
+        if length is None:
+            raise RecordError("length must look like HH:MM:SS")
+        if not datetime.timedelta(0) <= length <= MAX_LENGTH:
+            raise out_of_range
+    return Movie(pk=parse_id(record.get('id'), 'id'), title=title, length=length)
+
+
+def parse_screening(record):
+    time = parse_time(str(record.get('time') or ''))
+    if time is None:
+        raise RecordError("time must look like HH:MM:SS")
+    room = parse_id(record.get('room'), 'room')
+    movie = parse_id(record.get('movie'), 'movie')
+    if room is None or movie is None:
+        raise RecordError("room and movie are required")
+    return Screening(pk=parse_id(record.get('id'), 'id'), room_id=room, movie_id=movie, time=time)
+
+
+PARSERS = {
+    'rooms': parse_room,
+    'movies': parse_movie,
+    'screenings': parse_screening,
+}
+
+
+def parse(kind, lines, format):
+    objects, numbers, errors = [], [], []
+    try:
+        for number, record in read_records(lines, format):
+            try:
+                objects.append(PARSERS[kind](record))
+                numbers.append(number)
+            except RecordError as error:
+                errors.append("Line {}: {}".format(number, error))
+            if len(errors) >= MAX_ERRORS:
+                break
+    except RecordError as error:
+        errors.append(str(error))
+    ids = collections.Counter(obj.pk for obj in objects if obj.pk is not None)
+    errors.extend("Duplicate id {}".format(pk) for pk, count in ids.items() if count > 1)
+    return objects, numbers, errors
+
+
+def existing_ids(model, ids):
+    found = set()
+    for chunk in chunked(ids):
+        found.update(model.objects.filter(pk__in=chunk).values_list('pk', flat=True))
+    return found
+
+
+def find_conflicts(screenings, numbers, label='Line'):
+    """Check new screenings against each other and the database in one sweep per room.
+
+    Returns an error per conflicting row. Every interval's start and end are laid out
+    on one day, with screenings that wrap past midnight also copied a day earlier,
+    and two intervals that overlap only conflict if their runs share a date.
+    """
+    errors = []
+    lengths = {}
+    for chunk in chunked({screening.movie_id for screening in screenings}):
+        lengths.update(Movie.objects.filter(pk__in=chunk).values_list('pk', 'length'))
+    rooms = {screening.room_id for screening in screenings}
+    intervals = collections.defaultdict(list)
+    for chunk in chunked(rooms):
+        for room, start, end, first, last, weekdays in Screening.objects.filter(room__in=chunk).values_list(
+                'room', 'start_offset', 'end_offset', 'rule__first_date', 'rule__last_date', 'rule__weekdays'):
+            intervals[room].append((start, end, EVERY_DAY if weekdays is None else (first, last, weekdays), None))
+    unknown_movies = set()
+    for screening, number in zip(screenings, numbers):
+        if screening.movie_id not in lengths:
+            unknown_movies.add(number)
+            continue
+        screening.start_offset = seconds_since_midnight(screening.time)
+        screening.end_offset = screening.start_offset + int(lengths[screening.movie_id].total_seconds())
+        intervals[screening.room_id].append((screening.start_offset, screening.end_offset, screening.run(), number))
+    errors.extend("{} {}: unknown movie".format(label, number) for number in sorted(unknown_movies))
+
+    conflicting = set()
+    for room_intervals in intervals.values():
+        # The copy a day earlier belongs to the previous day's screening, so its run moves a day later
+        room_intervals.extend((start - SECONDS_PER_DAY, end - SECONDS_PER_DAY, shift_run(run, 1), number)
+                              for start, end, run, number in list(room_intervals) if end > SECONDS_PER_DAY)
+        room_intervals.sort(key=lambda interval: interval[:2])
+        running = []
+        for start, end, run, number in room_intervals:
+            # In start order, only the intervals still running when this one starts can overlap it
+            running = [interval for interval in running if interval[1] > start]
+            for _, _, other_run, other_number in running:
+                if (number, other_number) != (None, None) and runs_share_date(run, other_run):
+                    conflicting.update(row for row in (number, other_number) if row is not None)
+            running.append((start, end, run, number))
+    errors.extend("{} {}: overlaps another screening".format(label, number) for number in sorted(conflicting))
+    return errors
+
+
+@transaction.atomic
+def import_catalog(kind, lines, format):
+    """Validate every record, then write them all in chunks or not at all.
+
+    Returns the number of records imported, raises CatalogError listing what's wrong.
+    """
+    objects, numbers, errors = parse(kind, lines, format)
+    if not errors and kind == 'screenings':
+        missing = {obj.room_id for obj in objects} - existing_ids(Room, {obj.room_id for obj in objects})
+        errors.extend("Unknown room {}".format(room) for room in sorted(missing))
+        if not errors:
+            errors.extend(find_conflicts(objects, numbers))
+    if errors:
+        raise CatalogError(errors[:MAX_ERRORS])
+
+    model = objects[0].__class__ if objects else None
+    try:
+        for chunk in chunked(objects):
+            model.objects.bulk_create(chunk)
+    except IntegrityError:
+        raise CatalogError(["Some ids already exist"])
+
+    # bulk_create skips the signals that keep schedules and cached responses current
+    if kind == 'rooms':
+        RoomSchedule.objects.bulk_create(
+            RoomSchedule(room_id=room) for room in Room.objects.filter(schedule__isnull=True).values_list(
+                'pk', flat=True).iterator())
+    elif kind == 'screenings':
+        RoomSchedule.rebuild_rooms(obj.room_id for obj in objects)
+    invalidate(kind)
+    return len(objects)
+
+
+@transaction.atomic
+def create_season(first_date, last_date, weekdays, entries):
+    """Create a rule and one screening under it per entry, all or nothing.
+
+    entries are dicts with room, movie and time. Returns the rule, raises CatalogError
+    listing the entries that don't fit.
+    """
+    rule = ScreeningRule.objects.create(first_date=first_date, last_date=last_date, weekdays=weekday_bits(weekdays))
+    screenings = [Screening(room_id=entry['room'], movie_id=entry['movie'], time=entry['time'], rule=rule)
+                  for entry in entries]
+    rooms = {screening.room_id for screening in screenings}
+    errors = ["Unknown room {}".format(room) for room in sorted(rooms - existing_ids(Room, rooms))]
+    if not errors:
+        errors = find_conflicts(screenings, range(1, len(screenings) + 1), label='Screening')
+    if errors:
+        # Raising rolls back the rule too
+        raise CatalogError(errors[:MAX_ERRORS])
+    for chunk in chunked(screenings):
+        Screening.objects.bulk_create(chunk)
+    RoomSchedule.rebuild_rooms(rooms)
+    invalidate('screenings')
+    return rule
+
+
+EXPORTS = {
+    'rooms': (Room, ['id', 'capacity'], lambda row: row),
+    'movies': (Movie, ['id', 'title', 'length'], lambda row: (row[0], row[1], duration_string(row[2]))),
+    'screenings': (Screening, ['id', 'room', 'movie', 'time'], lambda row: row[:3] + (str(row[3]),)),
+}
+
+
+def export_catalog(kind, format):
+    """Yield the whole table as text chunks, fetching rows from the database in batches"""
+    model, fieldnames, convert = EXPORTS[kind]
+    rows = model.objects.order_by('pk').values_list(*fieldnames).iterator(chunk_size=2000)
+    return write_records(fieldnames, (convert(row) for row in rows), format)
@@ -0,0 +1,62 @@
+import csv
+import io
+import json
+
+FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CHUNK_SIZE = 64 * 1024
+
+
+class RecordError(ValueError):
+    pass
+
+
+def format_for_path(path, default='ndjson'):
+    return 'csv' if path.lower().endswith('.csv') else default
+
+
+def read_records(lines, format):
+    """Yield (line number, dict) for each record in an iterable of text lines"""
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            raise RecordError("Line {}: {}".format(number, error))
+        if not isinstance(record, dict):
+            raise RecordError("Line {}: expected a JSON object".format(number))
+        yield number, record
+
+
+def write_records(fieldnames, rows, format):
+    """Yield the encoded rows in chunks of roughly CHUNK_SIZE characters.
+
+    rows is an iterable of tuples in fieldnames order. Nothing but the chunk being
+    built is held in memory, so this can stream a table of any size.
+    """
+    buffer = io.StringIO()
+    if format == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(fieldnames)
+        write = writer.writerow
+    else:
+        def write(row):
+            buffer.write(json.dumps(dict(zip(fieldnames, row))))
+            buffer.write('\n')
+    for row in rows:
+        write(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
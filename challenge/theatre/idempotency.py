@@ -0,0 +1,150 @@
+"""Replay the stored response when a POST is retried with the same Idempotency-Key.
+
+The first request with a key runs normally and its response is kept in the
+``idempotency`` cache, which holds a bounded number of entries and expires them
+after a day. A retry with the same key gets that response back without running
+the view, so a purchase retried after a timeout can't sell a second ticket.
+A retry that arrives while the first request is still running gets a 409, and
+reusing a key for a different request body gets a 422.
+
+A retry may reach another worker process, so the store must be shared by all of
+them and claim a key atomically. Keys are refused when it isn't.
+"""
+import hashlib
+
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.http import HttpResponse, HttpResponseBadRequest
+
+MAX_KEY_LENGTH = 255
+# Long enough for any request to finish, short enough that a crashed worker
+# doesn't block retries for long
+IN_FLIGHT_TIMEOUT = 60
+IN_FLIGHT = 'in-flight'
+DONE = 'done'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+# Shared between processes, with an add() that only one of two racing requests wins
+SHARED_BACKENDS = (DatabaseCache, BaseMemcachedCache)
+
+INVALID_KEY = "Idempotency-Key must be 1 to {} characters".format(MAX_KEY_LENGTH)
+IN_PROGRESS = "A request with this Idempotency-Key is still in progress"
+KEY_REUSED = "Idempotency-Key was already used for a different request"
+NOT_SHARED = "Idempotency-Key is not supported, the idempotency store is not shared between workers"
+
+
+class KeyInUse(Exception):
+    pass
+
+
+class KeyReused(Exception):
+    pass
+
+
+def store():
+    return caches['idempotency']
+
+
+def shared_store():
+    return isinstance(store(), SHARED_BACKENDS)
+
+
+def store_key(method, path, key):
+    return 'theatre:idempotency:{}'.format(hashlib.sha256('{} {} {}'.format(method, path, key).encode()).hexdigest())
+
+
+def fingerprint(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+def claim(key, request_fingerprint):
+    """Return the stored (status, content type, content) to replay, or None if the request should run.
+
+    Raises KeyInUse while another request with the key is running, and KeyReused if
+    the key was used for a request with a different body.
+    """
+    entry = store().get(key)
+    if entry is None:
+        if store().add(key, (IN_FLIGHT, request_fingerprint, None), IN_FLIGHT_TIMEOUT):
+            return None
+        # Another request claimed it first
+        entry = store().get(key)
+        if entry is None:
+            raise KeyInUse()
+    state, stored_fingerprint, response = entry
+    if stored_fingerprint != request_fingerprint:
+        raise KeyReused()
+    if state == IN_FLIGHT:
+        raise KeyInUse()
+    return response
+
+
+def remember(key, request_fingerprint, status, content_type, content):
+    # Server errors aren't the request's answer, let a retry run it again
+    if status >= 500:
+        store().delete(key)
+    else:
+        store().set(key, (DONE, request_fingerprint, (status, content_type, content)))
+
+
+def run_once(method, path, key, body, func):
+    """Call func, which returns (status, content type, content), at most once per key.
+
+    For callers outside the middleware. Returns func's result or the stored one,
+    with a flag saying whether it was replayed.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return 400, 'text/html; charset=utf-8', INVALID_KEY.encode(), False
+    if not shared_store():
+        return 400, 'text/html; charset=utf-8', NOT_SHARED.encode(), False
+    key = store_key(method, path, key)
+    request_fingerprint = fingerprint(body)
+    try:
+        stored = claim(key, request_fingerprint)
+    except KeyInUse:
+        return 409, 'text/html; charset=utf-8', IN_PROGRESS.encode(), False
+    except KeyReused:
+        return 422, 'text/html; charset=utf-8', KEY_REUSED.encode(), False
+    if stored is not None:
+        return stored + (True,)
+    try:
+        status, content_type, content = func()
+    except Exception:
+        store().delete(key)
+        raise
+    remember(key, request_fingerprint, status, content_type, content)
+    return status, content_type, content, False
+
+
+class IdempotencyMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if request.method != 'POST' or key is None:
+            return self.get_response(request)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return HttpResponseBadRequest(INVALID_KEY)
+        if not shared_store():
+            return HttpResponseBadRequest(NOT_SHARED)
+        key = store_key(request.method, request.path, key)
+        request_fingerprint = fingerprint(request.body)
+        try:
+            stored = claim(key, request_fingerprint)
+        except KeyInUse:
+            return HttpResponse(IN_PROGRESS, status=409)
+        except KeyReused:
+            return HttpResponse(KEY_REUSED, status=422)
+        if stored is not None:
+            status, content_type, content = stored
+            response = HttpResponse(content, status=status, content_type=content_type)
+            response[REPLAYED_HEADER] = 'true'
+            return response
+
+        response = self.get_response(request)
+        if response.streaming:
+            store().delete(key)
+        else:
+            remember(key, request_fingerprint, response.status_code, response['Content-Type'], response.content)
+        return response
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from theatre.catalog import KINDS, export_catalog
+from theatre.formats import FORMATS, format_for_path
+
+
+class Command(BaseCommand):
+    help = "Stream every room, movie or screening out as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=KINDS)
+        parser.add_argument('--output', default='-', help="file to write, or - for standard output")
+        parser.add_argument('--format', choices=FORMATS,
+                            help="defaults to csv for .csv files and ndjson otherwise")
+
+    def handle(self, *args, **options):
+        path = options['output']
+        format = options['format'] or format_for_path(path)
+        if path == '-':
+            for chunk in export_catalog(options['kind'], format):
+                self.stdout.write(chunk, ending='')
+        else:
+            with open(path, 'w', newline='', encoding='utf-8') as output:
+                output.writelines(export_catalog(options['kind'], format))
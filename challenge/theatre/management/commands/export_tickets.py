@@ -0,0 +1,36 @@
+import argparse
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from theatre.formats import FORMATS, format_for_path
+from theatre.settlement import export_tickets
+
+
+def date_argument(value):
+    date = parse_date(value)
+    if date is None:
+        raise argparse.ArgumentTypeError("expected a date like 2019-12-31, not {!r}".format(value))
+    return date
+
+
+class Command(BaseCommand):
+    help = "Stream every ticket in a date range, with its screening, out as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('start', type=date_argument, help="first date, YYYY-MM-DD")
+        parser.add_argument('end', type=date_argument, help="last date, YYYY-MM-DD")
+        parser.add_argument('--output', default='-', help="file to write, or - for standard output")
+        parser.add_argument('--format', choices=FORMATS,
+                            help="defaults to csv for .csv files and ndjson otherwise")
+
+    def handle(self, *args, **options):
+        path = options['output']
+        format = options['format'] or format_for_path(path)
+        chunks = export_tickets(options['start'], options['end'], format)
+        if path == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+        else:
+            with open(path, 'w', newline='', encoding='utf-8') as output:
+                output.writelines(chunks)
@@ -0,0 +1,31 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from theatre.catalog import KINDS, CatalogError, import_catalog
+from theatre.formats import FORMATS, format_for_path
+
+
+class Command(BaseCommand):
+    help = "Bulk import rooms, movies or screenings from an NDJSON or CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=KINDS)
+        parser.add_argument('path', help="file to read, or - for standard input")
+        parser.add_argument('--format', choices=FORMATS,
+                            help="defaults to csv for .csv files and ndjson otherwise")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or format_for_path(path)
+        try:
+            if path == '-':
+                imported = import_catalog(options['kind'], sys.stdin, format)
+            else:
+                with open(path, newline='', encoding='utf-8') as lines:
+                    imported = import_catalog(options['kind'], lines, format)
+        except CatalogError as error:
+            raise CommandError('\n'.join(error.errors))
+        except OSError as error:
+            raise CommandError(error)
+        self.stdout.write("Imported {} {}".format(imported, options['kind']))
@@ -0,0 +1,29 @@
+import collections
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from theatre.models import SeatHold, SeatInventory, Ticket
+
+
+class Command(BaseCommand):
+    help = ("Recount the seats sold for every screening and date from its tickets and holds, e.g. to give back "
+            "seats reserved by a crashed write-behind process. Run it while sales are paused")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            sold = collections.Counter()
+            for row in Ticket.objects.values('screening', 'date').annotate(count=Count('pk')).order_by():
+                sold[row['screening'], row['date']] = row['count']
+            for hold in SeatHold.objects.all():
+                sold[hold.screening_id, hold.date] += len(hold.seat_numbers())
+            changed = []
+            inventories = SeatInventory.objects.select_for_update().only('screening', 'date', 'sold')
+            for inventory in inventories.iterator():
+                counted = sold[inventory.screening_id, inventory.date]
+                if inventory.sold != counted:
+                    inventory.sold = counted
+                    changed.append(inventory)
+            SeatInventory.objects.bulk_update(changed, ['sold'], batch_size=500)
+        self.stdout.write("Recounted {} inventories".format(len(changed)))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from theatre.models import SeatHold
+
+
+class Command(BaseCommand):
+    help = "Give the seats of every expired hold back. Run it every minute or so, e.g. from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help="holds released per transaction")
+
+    def handle(self, *args, **options):
+        released = SeatHold.objects.expired().release(batch_size=options['batch_size'])
+        self.stdout.write("Released {} expired holds".format(released))
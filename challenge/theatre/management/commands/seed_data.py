@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from theatre.models import Room, Movie
+from theatre.seed import seed
+from .export_tickets import date_argument
+
+
+class Command(BaseCommand):
+    help = "Fill an empty database with rooms, movies, screenings and tickets for benchmarking"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=500)
+        parser.add_argument('--screenings', type=int, default=10000)
+        parser.add_argument('--movies', type=int, default=200)
+        parser.add_argument('--days', type=int, default=30, help="days of tickets")
+        parser.add_argument('--tickets', type=int, default=1000000)
+        parser.add_argument('--start', type=date_argument, help="first ticket date, defaults to tomorrow")
+        parser.add_argument('--seed', type=int, default=0, help="random seed, the same seed gives the same data")
+
+    def handle(self, *args, **options):
+        if Room.objects.exists() or Movie.objects.exists():
+            raise CommandError("The database already has data, empty it first with `manage.py flush`")
+        started = time.perf_counter()
+        try:
+            created = seed(rooms=options['rooms'], screenings=options['screenings'], movies=options['movies'],
+                           days=options['days'], tickets=options['tickets'], start=options['start'],
+                           random_seed=options['seed'])
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write("Created {rooms} rooms, {movies} movies, {screenings} screenings and {tickets} tickets "
+                          "over {days} days in {seconds:.1f}s".format(
+                              seconds=time.perf_counter() - started, **created))
@@ -0,0 +1,164 @@
+"""Per-request performance metrics.
+
+MetricsMiddleware counts each request's queries and times its database work,
+response serialization and total handling. The numbers go back to the client
+in a ``Server-Timing`` header and into per-process histograms, which
+``/metrics/`` serves in the Prometheus text format.
+"""
+import bisect
+import contextlib
+import threading
+import time
+
+from django.db import connection
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# name, help text, Timings attribute, buckets
+METRICS = (
+    ('theatre_request_duration_seconds', 'Total time spent handling the request.', 'total', DURATION_BUCKETS),
+    ('theatre_request_db_seconds', 'Time spent running database queries.', 'db', DURATION_BUCKETS),
+    ('theatre_request_serialize_seconds', 'Time spent serializing response data.', 'serialize', DURATION_BUCKETS),
+    ('theatre_request_queries', 'Database queries run by the request.', 'queries', QUERY_BUCKETS),
+)
+
+_local = threading.local()
+
+
+class Timings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.total = 0.0
+        self.serializing = False
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db += time.perf_counter() - start
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    def server_timing(self):
+        return 'db;dur={:.2f};desc="{} queries", serialize;dur={:.2f}, total;dur={:.2f}'.format(
+            self.db * 1000, self.queries, self.serialize * 1000, self.total * 1000)
+
+
+@contextlib.contextmanager
+def collect(timings):
+    # Attribute this thread's queries and serializer work to timings
+    _local.timings = timings
+    try:
+        with connection.execute_wrapper(timings.record_query):
+            yield timings
+    finally:
+        _local.timings = None
+
+
+@contextlib.contextmanager
+def serializing():
+    # Adds the block's time to the current request's serialize timing. Nested
+    # blocks, e.g. per-item calls of a list, are covered by the outermost only.
+    timings = getattr(_local, 'timings', None)
+    if timings is None or timings.serializing:
+        yield
+        return
+    timings.serializing = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.serialize += time.perf_counter() - start
+        timings.serializing = False
+
+
+class TimedRepresentationMixin:
+    def to_representation(self, instance):
+        with serializing():
+            return super().to_representation(instance)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket plus +Inf, not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {name: {} for name, _, _, _ in METRICS}
+
+    def observe(self, view, method, timings):
+        with self.lock:
+            for name, _, attribute, buckets in METRICS:
+                histogram = self.histograms[name].setdefault((view, method), Histogram(buckets))
+                histogram.observe(getattr(timings, attribute))
+
+    def clear(self):
+        with self.lock:
+            for histograms in self.histograms.values():
+                histograms.clear()
+
+    def exposition(self):
+        lines = []
+        with self.lock:
+            for name, help, _, buckets in METRICS:
+                lines.append('# HELP {} {}'.format(name, help))
+                lines.append('# TYPE {} histogram'.format(name))
+                for (view, method), histogram in sorted(self.histograms[name].items()):
+                    labels = 'view="{}",method="{}"'.format(view, method)
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative))
+                    lines.append('{}_sum{{{}}} {}'.format(name, labels, histogram.sum))
+                    lines.append('{}_count{{{}}} {}'.format(name, labels, cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def view_name(request):
+    match = request.resolver_match
+    if match is None:
+        # Answered before URL resolution, e.g. a replayed idempotent request
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return 'unmatched'
+    return match.view_name
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = Timings()
+        with collect(timings):
+            response = self.get_response(request)
+        timings.finish()
+        registry.observe(view_name(request), request.method, timings)
+        response['Server-Timing'] = timings.server_timing()
+        return response
+
+
+def metrics(request):
+    return HttpResponse(registry.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.7 on 2026-10-18 16:30
+
+from django.db import migrations, models
+
+
+def populate_bounds(apps, schema_editor):
+    Screening = apps.get_model('theatre', 'Screening')
+    for screening in Screening.objects.select_related('movie'):
+        time = screening.time
+        screening.start_offset = time.hour * 3600 + time.minute * 60 + time.second
+        screening.end_offset = screening.start_offset + int(screening.movie.length.total_seconds())
+        screening.save(update_fields=['start_offset', 'end_offset'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('theatre', '0002_auto_20191122_0057'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='screening',
+            name='end_offset',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='screening',
+            name='start_offset',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_bounds, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='screening',
+            index=models.Index(fields=['room', 'start_offset', 'end_offset'], name='screening_room_bounds_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.7 on 2026-10-18 16:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_inventory(apps, schema_editor):
+    Ticket = apps.get_model('theatre', 'Ticket')
+    SeatInventory = apps.get_model('theatre', 'SeatInventory')
+    sales = (Ticket.objects.values('screening', 'date', 'screening__room__capacity')
+             .annotate(sold=models.Count('id')).order_by())
+    SeatInventory.objects.bulk_create(
+        SeatInventory(screening_id=sale['screening'], date=sale['date'],
+                      capacity=sale['screening__room__capacity'], sold=sale['sold'])
+        for sale in sales)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('theatre', '0003_screening_bounds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatInventory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('capacity', models.PositiveIntegerField()),
+                ('sold', models.PositiveIntegerField(default=0)),
+                ('screening', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='theatre.Screening')),
+            ],
+            options={
+                'unique_together': {('screening', 'date')},
+            },
+        ),
+        migrations.RunPython(populate_inventory, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.7 on 2026-10-18 16:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('theatre', '0004_seat_inventory'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='screening',
+            index=models.Index(fields=['time'], name='screening_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['screening', 'date'], name='ticket_screening_date_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.7 on 2026-10-18 16:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+import json
+
+
+def populate_schedules(apps, schema_editor):
+    Room = apps.get_model('theatre', 'Room')
+    RoomSchedule = apps.get_model('theatre', 'RoomSchedule')
+    for room in Room.objects.all():
+        entries = []
+        for screening in room.screening_set.select_related('movie').order_by('start_offset', 'pk'):
+            end = screening.end_offset % (24 * 60 * 60)
+            entries.append({
+                'screening': screening.pk,
+                'movie': screening.movie_id,
+                'title': screening.movie.title,
+                'start': str(screening.time),
+                'end': '{:02}:{:02}:{:02}'.format(end // 3600, end // 60 % 60, end % 60),
+            })
+        RoomSchedule.objects.create(room=room, entries=json.dumps(entries))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('theatre', '0005_ticket_screening_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomSchedule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entries', models.TextField(default='[]')),
+                ('room', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='schedule', to='theatre.Room')),
+            ],
+        ),
+        migrations.RunPython(populate_schedules, migrations.RunPython.noop),
+    ]
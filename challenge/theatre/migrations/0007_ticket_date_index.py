@@ -0,0 +1,17 @@
+# Generated by Django 2.2.7 on 2026-10-18 16:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('theatre', '0006_room_schedule'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['date'], name='ticket_date_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.2.7 on 2026-10-18 16:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('theatre', '0007_ticket_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatHold',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('seats', models.BinaryField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='seatinventory',
+            name='seats',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='seatinventory',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='seat',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='ticket',
+            constraint=models.UniqueConstraint(fields=('screening', 'date', 'seat'), name='ticket_seat_unique'),
+        ),
+        migrations.AddField(
+            model_name='seathold',
+            name='screening',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='theatre.Screening'),
+        ),
+    ]
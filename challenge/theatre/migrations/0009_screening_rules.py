@@ -0,0 +1,28 @@
+# Generated by Django 2.2.7 on 2026-10-18 16:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('theatre', '0008_seat_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScreeningRule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_date', models.DateField()),
+                ('last_date', models.DateField()),
+                ('weekdays', models.PositiveSmallIntegerField(default=127)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='screening',
+            name='rule',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='screenings', to='theatre.ScreeningRule'),
+        ),
+    ]
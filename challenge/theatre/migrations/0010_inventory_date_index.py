@@ -0,0 +1,17 @@
+# Generated by Django 2.2.7 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('theatre', '0009_screening_rules'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='seatinventory',
+            index=models.Index(fields=['date'], name='inventory_date_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.7 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('theatre', '0010_inventory_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='receipt',
+            field=models.UUIDField(blank=True, null=True, unique=True),
+        ),
+    ]
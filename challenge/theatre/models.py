@@ -1,10 +1,98 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+import collections
 import datetime
+import json
+import uuid
+
+SECONDS_PER_DAY = 24 * 60 * 60
+HOLD_DURATION = datetime.timedelta(minutes=10)
+# Attempts at an optimistic seat map update before reporting the seats unavailable
+SEAT_MAP_RETRIES = 5
+
+
+def seconds_since_midnight(time):
+    return time.hour * 3600 + time.minute * 60 + time.second
+
+
+def time_of_day(seconds):
+    seconds %= SECONDS_PER_DAY
+    return datetime.time(hour=seconds // 3600, minute=seconds // 60 % 60, second=seconds % 60)
+
+
+ALL_WEEKDAYS = 0b1111111
+# The run of a screening without a rule: every day, forever
+EVERY_DAY = (None, None, ALL_WEEKDAYS)
+
+
+def shift_run(run, days):
+    # The dates of run moved by days, weekday bits rotated to match
+    first, last, weekdays = run
+    if days == 0:
+        return run
+    offset = datetime.timedelta(days=days)
+    days %= 7
+    weekdays = (weekdays << days | weekdays >> (7 - days)) & ALL_WEEKDAYS
+    return (first and first + offset, last and last + offset, weekdays)
+
+
+def weekday_bits(weekdays):
+    return sum(1 << day for day in set(weekdays))
+
+
+def runs_on(run, date):
+    first, last, weekdays = run
+    return ((first is None or first <= date) and (last is None or date <= last)
+            and bool(weekdays >> date.weekday() & 1))
+
+
+def overlapping_shifts(first_bounds, second_bounds):
+    """Day shifts in (1, 0, -1) of the second interval that make it overlap the first."""
+    start1, end1 = first_bounds
+    start2, end2 = second_bounds
+    return [-shift // SECONDS_PER_DAY for shift in (-SECONDS_PER_DAY, 0, SECONDS_PER_DAY)
+            if min(end1, end2 + shift) - max(start1, start2 + shift) > 0]
+
+
+def runs_share_date(first_run, second_run):
+    """Whether some date falls in both runs, each (first date, last date, weekday bits)."""
+    firsts = [date for date in (first_run[0], second_run[0]) if date is not None]
+    lasts = [date for date in (first_run[1], second_run[1]) if date is not None]
+    weekdays = first_run[2] & second_run[2]
+    start = max(firsts) if firsts else None
+    end = min(lasts) if lasts else None
+    if start is None or end is None or (end - start).days >= 6:
+        return bool(weekdays)
+    # Less than a week in common, check the weekday of each date in it
+    return any(weekdays >> (start + datetime.timedelta(days=day)).weekday() & 1
+               for day in range((end - start).days + 1))
+
+
+def seat_bitmap(seats):
+    bitmap = 0
+    for seat in seats:
+        bitmap |= 1 << seat
+    return bitmap
+
+
+def seat_numbers(bitmap):
+    return [seat for seat in range(bitmap.bit_length()) if bitmap >> seat & 1]
+
+
+def bitmap_bytes(bitmap):
+    return bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
 
 
 class Room(models.Model):
     capacity = models.PositiveIntegerField(default=100)
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if not adding:
+            SeatInventory.objects.filter(screening__room=self).update(capacity=self.capacity)
+
     def __str__(self):
         return "{} - Seats {}".format(self.id, self.capacity)
 
@@ -13,43 +101,463 @@ class Movie(models.Model):
     title = models.CharField(max_length=200)
     length = models.DurationField(default=datetime.timedelta(minutes=90))
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if not adding:
+            # Keep the stored end of every screening of this movie in step with its length
+            Screening.objects.filter(movie=self).update(
+                end_offset=models.F('start_offset') + int(self.length.total_seconds()))
+
     def __str__(self):
         return "{} - {}".format(self.title, self.length)
 
 
+class ScreeningRule(models.Model):
+    # A season: the screenings pointing at a rule run from first_date to last_date,
+    # on the weekdays set in weekdays (bit 0 is Monday)
+    first_date = models.DateField()
+    last_date = models.DateField()
+    weekdays = models.PositiveSmallIntegerField(default=ALL_WEEKDAYS)
+
+    def run(self):
+        return self.first_date, self.last_date, self.weekdays
+
+    def weekday_numbers(self):
+        return [day for day in range(7) if self.weekdays >> day & 1]
+
+    def __str__(self):
+        return "{} to {} on {}".format(self.first_date, self.last_date, self.weekday_numbers())
+
+
+class ScreeningQuerySet(models.QuerySet):
+    def overlapping(self, screening):
+        start, end = screening.bounds()
+        # Screenings repeat daily, so also compare against existing screenings shifted
+        # a day either way to catch the ones that wrap past midnight.
+        overlaps = models.Q()
+        for shift in (-SECONDS_PER_DAY, 0, SECONDS_PER_DAY):
+            overlaps |= models.Q(start_offset__lt=end - shift, end_offset__gt=start - shift)
+        overlapping = self.filter(overlaps, room=screening.room_id)
+        if screening.pk is not None:
+            overlapping = overlapping.exclude(pk=screening.pk)
+        return overlapping
+
+    def conflicting(self, screening):
+        """Screenings that overlap screening's time on a date they both run.
+
+        The overlapping query narrows the room down to the few screenings that overlap
+        in time, whose runs are then compared here.
+        """
+        run, bounds = screening.run(), screening.bounds()
+        # Saved screenings carry their offsets, so their movies needn't be loaded
+        return [other for other in self.overlapping(screening).select_related('rule')
+                if any(runs_share_date(run, shift_run(other.run(), shift))
+                       for shift in overlapping_shifts(bounds, (other.start_offset, other.end_offset)))]
+
+    def availability(self, start, end, current_time=None):
+        if current_time is None:
+            current_time = datetime.datetime.now()
+        screenings = self.order_by('pk').values_list(
+            'pk', 'time', 'room__capacity', 'rule__first_date', 'rule__last_date', 'rule__weekdays')
+        # Sold counts come from the inventory counters in a single query, never from the tickets
+        sold = {(screening, date): count for screening, date, count in SeatInventory.objects.filter(
+            screening__in=self.values('pk'), date__range=(start, end)).values_list('screening', 'date', 'sold')}
+        dates = [start + datetime.timedelta(days=day) for day in range((end - start).days + 1)]
+        availability = []
+        for screening, time, capacity, first, last, weekdays in screenings:
+            for date in dates:
+                if weekdays is not None and not runs_on((first, last, weekdays), date):
+                    continue
+                if datetime.datetime.combine(date, time) < current_time:
+                    remaining = 0
+                else:
+                    remaining = max(capacity - sold.get((screening, date), 0), 0)
+                availability.append({'screening': screening, 'date': date, 'remaining': remaining})
+        return availability
+
+
 class Screening(models.Model):
     room = models.ForeignKey(Room, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     time = models.TimeField()
+    # When and on which days the screening runs, every day forever without one
+    rule = models.ForeignKey('ScreeningRule', null=True, blank=True, on_delete=models.CASCADE,
+                             related_name='screenings')
+    # Seconds since midnight the screening starts and ends, derived from time and the
+    # movie's length. end_offset runs past SECONDS_PER_DAY for screenings that wrap
+    # past midnight.
+    start_offset = models.PositiveIntegerField(default=0, editable=False)
+    end_offset = models.PositiveIntegerField(default=0, editable=False)
 
-    def are_seats_remaining(self, date, current_time=None):
+    objects = ScreeningQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'start_offset', 'end_offset'], name='screening_room_bounds_idx'),
+            models.Index(fields=['time'], name='screening_time_idx'),
+        ]
+
+    def run(self):
+        if self.rule_id is None:
+            return EVERY_DAY
+        return self.rule.run()
+
+    def runs_on(self, date):
+        return runs_on(self.run(), date)
+
+    def overlapping_shifts(self, other):
+        """Day shifts of other's dates under which its time overlaps this screening's.
+
+        Shift 1 means other's screening on the day before, wrapping past midnight,
+        overlaps this one; -1 means this one wraps into other's screening the next day.
+        """
+        return overlapping_shifts(self.bounds(), other.bounds())
+
+    def bounds(self):
+        start = seconds_since_midnight(self.time)
+        return start, start + int(self.movie.length.total_seconds())
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        self.start_offset, self.end_offset = self.bounds()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'start_offset', 'end_offset'}
+        super().save(*args, **kwargs)
+        if not adding:
+            SeatInventory.objects.filter(screening=self).update(capacity=self.room.capacity)
+
+    def has_started(self, date, current_time=None):
         if current_time is None:
             current_time = datetime.datetime.now()
+        return datetime.datetime.combine(date, self.time) < current_time
 
+    def are_seats_remaining(self, date, current_time=None):
         # No seats remaining for showings that have already started
-        if datetime.datetime.combine(date, self.time) < current_time:
+        if self.has_started(date, current_time):
             return False
 
-        return self.ticket_set.filter(date=date).count() < self.room.capacity
+        inventory = SeatInventory.objects.filter(screening=self, date=date).values_list('sold', 'capacity').first()
+        if inventory is None:
+            return self.room.capacity > 0
+        sold, capacity = inventory
+        return sold < capacity
+
+    def seat_map(self, date, current_time=None):
+        inventory = SeatInventory.objects.filter(screening=self, date=date).values_list(
+            'capacity', 'sold', 'seats').first()
+        capacity, sold, taken = self.room.capacity, 0, 0
+        if inventory is not None:
+            capacity, sold, seats = inventory
+            taken = int.from_bytes(bytes(seats), 'little')
+        return {
+            'screening': self.pk,
+            'date': date,
+            'capacity': capacity,
+            'remaining': 0 if self.has_started(date, current_time) else max(capacity - sold, 0),
+            'taken': seat_numbers(taken),
+        }
+
+    def reserve_seats(self, date, quantity=1):
+        # A single conditional UPDATE claims the seats, and only if enough of them remain
+        claim = SeatInventory.objects.filter(
+            screening=self, date=date, sold__lte=models.F('capacity') - quantity)
+        if claim.update(sold=models.F('sold') + quantity):
+            return True
+        # Either sold out or the first sale for this date. Make sure the row exists
+        # without racing other buyers, then try again.
+        SeatInventory.objects.bulk_create(
+            [SeatInventory(screening=self, date=date, capacity=self.room.capacity)], ignore_conflicts=True)
+        return bool(claim.update(sold=models.F('sold') + quantity))
+
+    def reserve_up_to(self, date, quantity):
+        # Claim as many of quantity seats as remain, returning how many were claimed
+        while quantity > 0:
+            if self.reserve_seats(date, quantity):
+                return quantity
+            remaining = SeatInventory.objects.filter(screening=self, date=date).values_list(
+                models.F('capacity') - models.F('sold'), flat=True).first()
+            quantity = min(quantity, remaining or 0)
+        return 0
+
+    def sell_tickets(self, date, quantity=1):
+        with transaction.atomic():
+            if not self.reserve_seats(date, quantity):
+                raise SeatsUnavailable("Fewer than {} seats remaining for {} on {}".format(quantity, self, date))
+            tickets = Ticket.objects.bulk_create(Ticket(screening=self, date=date) for _ in range(quantity))
+            if tickets[0].pk is None:
+                # The backend can't return ids from a bulk insert. Every sale for this
+                # screening and date goes through the inventory row we just locked, so
+                # the newest tickets for it are ours.
+                tickets = Ticket.objects.filter(screening=self, date=date).order_by('-pk')[:quantity]
+                tickets = sorted(tickets, key=lambda ticket: ticket.pk)
+        return tickets
+
+    def release_seats(self, date, quantity=1, seats=()):
+        if not seats:
+            SeatInventory.objects.filter(screening=self, date=date).update(sold=models.F('sold') - quantity)
+            return
+        freed = seat_bitmap(seats)
+        self.update_seat_map(date, lambda taken, inventory: (taken & ~freed, -len(seats)))
+
+    def update_seat_map(self, date, change):
+        """Rewrite the seat map for date with change(taken, inventory).
+
+        change returns the new bitmap and the change in seats sold, or raises
+        SeatsUnavailable. The write only lands if nobody else changed the map since
+        it was read and enough seats remain, otherwise the map is read again.
+        """
+        for _ in range(SEAT_MAP_RETRIES):
+            inventory = SeatInventory.objects.filter(screening=self, date=date).first()
+            if inventory is None:
+                SeatInventory.objects.bulk_create(
+                    [SeatInventory(screening=self, date=date, capacity=self.room.capacity)], ignore_conflicts=True)
+                continue
+            taken, sold = change(inventory.taken(), inventory)
+            if inventory.sold + sold > inventory.capacity:
+                raise SeatsUnavailable("Fewer than {} seats remaining for {} on {}".format(sold, self, date))
+            written = SeatInventory.objects.filter(
+                pk=inventory.pk, version=inventory.version, sold__lte=models.F('capacity') - sold,
+            ).update(seats=bitmap_bytes(taken), sold=models.F('sold') + sold, version=models.F('version') + 1)
+            if written:
+                return
+        raise SeatsUnavailable("Seat map for {} on {} is busy".format(self, date))
+
+    def hold_seats(self, date, seats, now=None):
+        """Claim specific seats for HOLD_DURATION, returning the SeatHold to confirm."""
+        if now is None:
+            now = timezone.now()
+        # Before building the bitmap, whose size grows with the highest seat number
+        if max(seats) >= self.room.capacity:
+            raise SeatsUnavailable("Seats {} are not available for {} on {}".format(seats, self, date))
+        wanted = seat_bitmap(seats)
+
+        def claim(taken, inventory):
+            if taken & wanted or max(seats) >= inventory.capacity:
+                raise SeatsUnavailable("Seats {} are not available for {} on {}".format(seats, self, date))
+            return taken | wanted, len(seats)
+
+        with transaction.atomic():
+            self.update_seat_map(date, claim)
+            return SeatHold.objects.create(screening=self, date=date, seats=bitmap_bytes(wanted),
+                                           expires_at=now + HOLD_DURATION)
 
     def overlaps(self, other_screening):
-        # Overlap calc inspired by https://stackoverflow.com/a/9044111
-        start1 = datetime.datetime.combine(datetime.date.today(), self.time)
-        start2 = datetime.datetime.combine(datetime.date.today(), other_screening.time)
-        end1 = start1 + self.movie.length
-        end2 = start2 + other_screening.movie.length
-        latest_start = max(start1, start2)
-        earliest_end = min(end1, end2)
-        overlap = (earliest_end - latest_start)
-        return overlap > datetime.timedelta(0)
+        # Overlap calc inspired by https://stackoverflow.com/a/9044111, repeated with the
+        # other screening shifted a day either way for screenings that wrap past midnight
+        run = self.run()
+        return any(runs_share_date(run, shift_run(other_screening.run(), shift))
+                   for shift in self.overlapping_shifts(other_screening))
 
     def __str__(self):
         return "{} - {} @ {}".format(self.room, self.movie, self.time)
 
 
+class RoomSchedule(models.Model):
+    # A room's screenings in start order, stored as JSON and rebuilt whenever one of
+    # them changes (see theatre.signals) so reading a schedule is a single lookup
+    room = models.OneToOneField(Room, on_delete=models.CASCADE, related_name='schedule')
+    entries = models.TextField(default='[]')
+
+    @classmethod
+    def rebuild(cls, room_id, create=True):
+        cls.rebuild_rooms([room_id], create)
+
+    @classmethod
+    def rebuild_rooms(cls, room_ids, create=True, batch_size=500):
+        # A fixed number of queries per batch of rooms, however many there are
+        room_ids = sorted(set(room_ids))
+        for index in range(0, len(room_ids), batch_size):
+            cls._rebuild_batch(room_ids[index:index + batch_size], create)
+
+    @classmethod
+    def _rebuild_batch(cls, room_ids, create):
+        with transaction.atomic():
+            # Lock the rows before reading the screenings so concurrent rebuilds of a
+            # room queue up, each seeing the screenings committed before it
+            schedules = {schedule.room_id: schedule
+                         for schedule in cls.objects.select_for_update().filter(room__in=room_ids)}
+            if create:
+                for room_id in set(room_ids) - set(schedules):
+                    schedules[room_id], _ = cls.objects.get_or_create(room_id=room_id)
+            if not schedules:
+                return
+            entries = {room_id: [] for room_id in schedules}
+            screenings = Screening.objects.filter(room__in=list(schedules)).select_related(
+                'movie', 'rule').order_by('start_offset', 'pk')
+            for screening in screenings:
+                entry = {
+                    'screening': screening.pk,
+                    'movie': screening.movie_id,
+                    'title': screening.movie.title,
+                    'start': str(screening.time),
+                    'end': str(time_of_day(screening.bounds()[1])),
+                }
+                if screening.rule_id is not None:
+                    entry.update({
+                        'first_date': str(screening.rule.first_date),
+                        'last_date': str(screening.rule.last_date),
+                        'weekdays': screening.rule.weekday_numbers(),
+                    })
+                entries[screening.room_id].append(entry)
+            for room_id, schedule in schedules.items():
+                schedule.entries = json.dumps(entries[room_id])
+            cls.objects.bulk_update(schedules.values(), ['entries'])
+
+    def timeline(self, date=None):
+        """The room's screenings, or only those running on date."""
+        entries = json.loads(self.entries)
+        if date is None:
+            return entries
+        # Entries for screenings without a rule run every day
+        return [entry for entry in entries if runs_on((
+            entry.get('first_date') and parse_date(entry['first_date']),
+            entry.get('last_date') and parse_date(entry['last_date']),
+            weekday_bits(entry.get('weekdays', range(7)))), date)]
+
+    def __str__(self):
+        return "Schedule for {}".format(self.room_id)
+
+
+class SeatInventory(models.Model):
+    # Seats sold per screening and date, so a purchase is one conditional UPDATE
+    # instead of a COUNT over the tickets. capacity mirrors the screening's room.
+    screening = models.ForeignKey(Screening, on_delete=models.CASCADE)
+    date = models.DateField()
+    capacity = models.PositiveIntegerField()
+    sold = models.PositiveIntegerField(default=0)
+    # Bit n is set while seat n is held or sold to a seated ticket. Tickets sold
+    # without a seat only count towards sold. version changes with every write
+    # to seats, see Screening.update_seat_map.
+    seats = models.BinaryField(default=b'')
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [['screening', 'date']]
+        # Reports roll the counters up over a date range across every screening
+        indexes = [models.Index(fields=['date'], name='inventory_date_idx')]
+
+    def taken(self):
+        return int.from_bytes(bytes(self.seats), 'little')
+
+    def __str__(self):
+        return "{} - {} - {}/{}".format(self.screening, self.date, self.sold, self.capacity)
+
+
+class SeatHoldQuerySet(models.QuerySet):
+    def expired(self, now=None):
+        return self.filter(expires_at__lte=now or timezone.now())
+
+    def release(self, batch_size=200):
+        """Give back the seats of every hold in the queryset and delete them.
+
+        Works through the holds in batches, each taking a fixed number of queries
+        however many holds and screenings it covers. Returns how many were released.
+        """
+        released = 0
+        while True:
+            with transaction.atomic():
+                holds = list(self.select_for_update().order_by('pk')[:batch_size])
+                if not holds:
+                    return released
+                freed = collections.defaultdict(int)
+                for hold in holds:
+                    freed[hold.screening_id, hold.date] |= hold.bitmap()
+                inventories = SeatInventory.objects.select_for_update().filter(
+                    screening__in={screening for screening, _ in freed}, date__in={date for _, date in freed})
+                changed = []
+                for inventory in inventories:
+                    bitmap = freed.get((inventory.screening_id, inventory.date))
+                    if bitmap is None:
+                        continue
+                    inventory.seats = bitmap_bytes(inventory.taken() & ~bitmap)
+                    inventory.sold = models.F('sold') - bin(bitmap).count('1')
+                    inventory.version = models.F('version') + 1
+                    changed.append(inventory)
+                SeatInventory.objects.bulk_update(changed, ['seats', 'sold', 'version'])
+                SeatHold.objects.filter(pk__in=[hold.pk for hold in holds]).delete()
+                released += len(holds)
+
+
+class HoldExpired(Exception):
+    pass
+
+
+class SeatHold(models.Model):
+    # Seats set aside during checkout. They count as taken in the seat inventory
+    # until the hold is confirmed into tickets or released. Expired holds are
+    # released in bulk by the release_expired_holds command, not per request.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    screening = models.ForeignKey(Screening, on_delete=models.CASCADE)
+    date = models.DateField()
+    seats = models.BinaryField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    objects = SeatHoldQuerySet.as_manager()
+
+    def bitmap(self):
+        return int.from_bytes(bytes(self.seats), 'little')
+
+    def seat_numbers(self):
+        return seat_numbers(self.bitmap())
+
+    def confirm(self, now=None):
+        """Turn the held seats into tickets. The seats are already counted as sold."""
+        if now is None:
+            now = timezone.now()
+        seats = self.seat_numbers()
+        with transaction.atomic():
+            # Deleting first means confirming twice, or racing the sweeper, can only succeed once
+            if not SeatHold.objects.filter(pk=self.pk, expires_at__gt=now).delete()[0]:
+                raise HoldExpired("Hold {} has expired".format(self.pk))
+            tickets = Ticket.objects.bulk_create(
+                Ticket(screening_id=self.screening_id, date=self.date, seat=seat) for seat in seats)
+            if tickets[0].pk is None:
+                # Seats are unique per screening and date, so these are the tickets just made
+                tickets = list(Ticket.objects.filter(
+                    screening=self.screening_id, date=self.date, seat__in=seats).order_by('seat'))
+        return tickets
+
+    def __str__(self):
+        return "{} - {} - seats {}".format(self.screening, self.date, self.seat_numbers())
+
+
+class SeatsUnavailable(Exception):
+    pass
+
+
 class Ticket(models.Model):
     screening = models.ForeignKey(Screening, on_delete=models.CASCADE)
     date = models.DateField()
+    # Only set for tickets bought by holding specific seats
+    seat = models.PositiveIntegerField(null=True, blank=True)
+    # Only set for tickets granted by the write-behind queue, which writes them
+    # later and may replay them, see theatre.writebehind
+    receipt = models.UUIDField(null=True, blank=True, unique=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['screening', 'date'], name='ticket_screening_date_idx'),
+            models.Index(fields=['date'], name='ticket_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['screening', 'date', 'seat'], name='ticket_seat_unique'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        # Claim the seat and insert the ticket together so a failed insert can't leak a seat
+        with transaction.atomic():
+            if not self.screening.reserve_seats(self.date):
+                raise SeatsUnavailable("No seats remaining for {} on {}".format(self.screening, self.date))
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            self.screening.release_seats(self.date, seats=[self.seat] if self.seat is not None else ())
+            return super().delete(*args, **kwargs)
 
     def __str__(self):
         return "{} - {}".format(self.screening, self.date)
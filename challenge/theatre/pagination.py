@@ -0,0 +1,8 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    # Ids only ever grow, so paging on them stays stable while rows are being added
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,57 @@
+import collections
+import datetime
+from django.db.models import F, Sum
+from .models import Screening, SeatInventory, SeatHold, EVERY_DAY, runs_on
+
+GROUPS = ('movie', 'room', 'date')
+
+
+def dates(start, end):
+    return [start + datetime.timedelta(days=day) for day in range((end - start).days + 1)]
+
+
+def occupancy(start, end, group_by, room=None, movie=None):
+    """Tickets sold against seats offered from start to end, one row per group.
+
+    Sales come from the seat counters kept per screening and date, less the seats
+    still held, and seats offered from each room's capacity on the dates its
+    screenings run. That is three queries however many tickets were sold.
+    """
+    group_by = [group for group in GROUPS if group in group_by]
+    filters = {key: value for key, value in (('room', room), ('movie', movie)) if value is not None}
+    screening_filters = {'screening__' + key: value for key, value in filters.items()}
+    screening_groups = [group for group in group_by if group != 'date']
+
+    def key(values):
+        return tuple(values[group] for group in group_by)
+
+    sold = collections.Counter()
+    inventories = (SeatInventory.objects.filter(date__range=(start, end), **screening_filters)
+                   .values('date', **{group: F('screening__' + group) for group in screening_groups})
+                   .annotate(sold=Sum('sold')).order_by())
+    for row in inventories:
+        sold[key(row)] += row['sold']
+    # Held seats count towards sold until they are confirmed or released
+    for hold in SeatHold.objects.filter(date__range=(start, end), **screening_filters).select_related('screening'):
+        values = {'movie': hold.screening.movie_id, 'room': hold.screening.room_id, 'date': hold.date}
+        sold[key(values)] -= len(hold.seat_numbers())
+
+    offered = collections.Counter()
+    days = dates(start, end)
+    screenings = (Screening.objects.filter(**filters)
+                  .values('rule__first_date', 'rule__last_date', 'rule__weekdays', *screening_groups)
+                  .annotate(capacity=Sum('room__capacity')).order_by())
+    for row in screenings:
+        run = EVERY_DAY if row['rule__weekdays'] is None else (
+            row['rule__first_date'], row['rule__last_date'], row['rule__weekdays'])
+        for date in days:
+            if runs_on(run, date):
+                offered[key(dict(row, date=date))] += row['capacity']
+
+    rows = []
+    for group in sorted(set(offered) | set(sold)):
+        row = dict(zip(group_by, group))
+        row.update(sold=sold[group], capacity=offered[group],
+                   occupancy=round(sold[group] / offered[group], 4) if offered[group] else 0.0)
+        rows.append(row)
+    return rows
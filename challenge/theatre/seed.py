@@ -0,0 +1,87 @@
+"""Generate a large, consistent dataset for benchmarks and load tests.
+
+Every room gets evenly spaced screenings that never overlap, and tickets are
+spread over a range of dates. Seat inventory counters and room schedules are
+filled in to match, so every endpoint behaves as it would on real data.
+"""
+import datetime
+import random
+
+from django.db import transaction
+
+from .cache import invalidate
+from .models import Room, Movie, Screening, Ticket, SeatInventory, RoomSchedule
+
+MINUTES_PER_DAY = 24 * 60
+BATCH_SIZE = 10000
+
+
+def spread(total, buckets):
+    # Split total into buckets counts that differ by at most one
+    base, extra = divmod(total, buckets)
+    return [base + (index < extra) for index in range(buckets)]
+
+
+def batched(objects, model):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) == BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+    model.objects.bulk_create(batch)
+
+
+@transaction.atomic
+def seed(rooms=500, screenings=10000, movies=200, days=30, tickets=1000000, start=None, random_seed=0):
+    """Fill an empty database, returning how many of each thing were created.
+
+    Tickets are dated from start, tomorrow by default, over the following days.
+    Movies are at most three quarters of a screening slot long, so every
+    screening is followed by a gap another short screening fits into.
+    """
+    if min(rooms, screenings, movies, days) < 1 or tickets < 0:
+        raise ValueError("Need at least one room, screening, movie and day")
+    slot = MINUTES_PER_DAY // -(-screenings // rooms)
+    if slot < 4:
+        raise ValueError("Too many screenings per room, use more rooms")
+    if start is None:
+        start = datetime.date.today() + datetime.timedelta(days=1)
+    generator = random.Random(random_seed)
+    per_showing = spread(tickets, screenings * days)
+
+    # Leave headroom above the busiest showing so purchases can still succeed
+    min_capacity = per_showing[0] + 50
+    Room.objects.bulk_create(Room(capacity=generator.randint(min_capacity, min_capacity * 2)) for _ in range(rooms))
+    room_list = list(Room.objects.order_by('pk'))
+    RoomSchedule.objects.bulk_create(RoomSchedule(room=room) for room in room_list)
+
+    Movie.objects.bulk_create(
+        Movie(title='Movie {}'.format(index),
+              length=datetime.timedelta(minutes=generator.randint(max(1, slot // 2), slot * 3 // 4)))
+        for index in range(movies))
+    movie_list = list(Movie.objects.order_by('pk'))
+
+    def generate_screenings():
+        for room, count in zip(room_list, spread(screenings, rooms)):
+            for index in range(count):
+                minutes = index * slot
+                screening = Screening(room=room, movie=generator.choice(movie_list),
+                                      time=datetime.time(hour=minutes // 60, minute=minutes % 60))
+                screening.start_offset, screening.end_offset = screening.bounds()
+                yield screening
+    batched(generate_screenings(), Screening)
+    capacities = dict(Screening.objects.values_list('pk', 'room__capacity'))
+    showings = [(screening, start + datetime.timedelta(days=day))
+                for screening in sorted(capacities) for day in range(days)]
+
+    batched((SeatInventory(screening_id=screening, date=date, capacity=capacities[screening], sold=sold)
+             for (screening, date), sold in zip(showings, per_showing) if sold), SeatInventory)
+    batched((Ticket(screening_id=screening, date=date)
+             for (screening, date), sold in zip(showings, per_showing) for _ in range(sold)), Ticket)
+
+    # bulk_create skips the signals that keep schedules and cached responses current
+    RoomSchedule.rebuild_rooms(room.pk for room in room_list)
+    for namespace in ('rooms', 'movies', 'screenings'):
+        invalidate(namespace)
+    return {'rooms': rooms, 'movies': movies, 'screenings': screenings, 'days': days, 'tickets': tickets}
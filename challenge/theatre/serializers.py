@@ -1,27 +1,231 @@
+import datetime
+from django.db import models
+from django.utils.duration import duration_string
 from rest_framework import serializers
-from .models import Room, Movie, Screening, Ticket
+from .formats import FORMATS
+from .metrics import TimedRepresentationMixin, serializing
+from .reports import GROUPS
+from .models import Room, Movie, Screening, ScreeningRule, Ticket, RoomSchedule, SeatHold
 
 
-class RoomSerializer(serializers.ModelSerializer):
+# How ValuesSerializer turns a database value into what the field's DRF serializer
+# field would output, for the model fields where the two differ
+VALUE_CONVERTERS = {
+    models.DateField: datetime.date.isoformat,
+    models.TimeField: datetime.time.isoformat,
+    models.DurationField: duration_string,
+    models.UUIDField: str,
+}
+
+
+class SparseFieldsMixin:
+    # Lets GET requests pick a subset of fields, e.g. ?fields=id,title
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Nested serializers aren't bound to their parent yet, so they have no
+        # context here and keep all of their fields
+        request = self.context.get('request')
+        if request is None or request.method != 'GET' or not request.query_params.get('fields'):
+            return
+        requested = set(request.query_params['fields'].split(','))
+        for name in set(self.fields) - requested:
+            self.fields.pop(name)
+
+
+class RoomSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Room
         fields = ['id', 'capacity']
 
 
-class MovieSerializer(serializers.ModelSerializer):
+class MovieSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Movie
         fields = ['id', 'title', 'length']
 
 
-class ScreeningSerializer(serializers.ModelSerializer):
+class ScreeningSerializer(TimedRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Screening
-        fields = ['id', 'room', 'movie', 'time']
+        fields = ['id', 'room', 'movie', 'time', 'rule']
+        read_only_fields = ['rule']
+
+
+class ExpandedScreeningSerializer(ScreeningSerializer):
+    room = RoomSerializer(read_only=True)
+    movie = MovieSerializer(read_only=True)
+
 
+class RoomScheduleSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
+    screenings = serializers.SerializerMethodField()
 
-class TicketSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RoomSchedule
+        fields = ['room', 'screenings']
+
+    def get_screenings(self, schedule):
+        return schedule.timeline(self.context.get('date'))
+
+
+class QueuedTicketSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
+    # Granted by the write-behind queue and not written yet, so no id
     class Meta:
         model = Ticket
-        fields = ['id', 'screening']
+        fields = ['receipt', 'screening', 'date', 'seat']
+
+
+class ScreeningRuleSerializer(serializers.ModelSerializer):
+    weekdays = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ScreeningRule
+        fields = ['id', 'first_date', 'last_date', 'weekdays']
+
+    def get_weekdays(self, rule):
+        return rule.weekday_numbers()
+
+
+class TicketSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Ticket
+        fields = ['id', 'screening', 'seat']
+
+
+class SeatHoldSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
+    seats = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SeatHold
+        fields = ['id', 'screening', 'date', 'seats', 'expires_at']
+
+    def get_seats(self, hold):
+        return hold.seat_numbers()
+
+
+class SeatHoldRequestSerializer(serializers.Serializer):
+    MAX_SEATS = 20
+    # Seats are numbered below the room's capacity, a PositiveIntegerField
+    MAX_SEAT = 2 ** 31 - 2
+
+    date = serializers.DateField(default=datetime.date.today)
+    seats = serializers.ListField(child=serializers.IntegerField(min_value=0, max_value=MAX_SEAT), min_length=1,
+                                  max_length=MAX_SEATS)
+
+    def validate_seats(self, seats):
+        if len(set(seats)) != len(seats):
+            raise serializers.ValidationError("Seats must not repeat")
+        return sorted(seats)
+
+
+class SeasonScreeningSerializer(serializers.Serializer):
+    room = serializers.IntegerField()
+    movie = serializers.IntegerField()
+    time = serializers.TimeField()
+
+
+class SeasonSerializer(serializers.Serializer):
+    MAX_SCREENINGS = 10000
+
+    first_date = serializers.DateField()
+    last_date = serializers.DateField()
+    # 0 is Monday, as in date.weekday()
+    weekdays = serializers.ListField(child=serializers.IntegerField(min_value=0, max_value=6), min_length=1,
+                                     default=lambda: list(range(7)))
+    screenings = SeasonScreeningSerializer(many=True, allow_empty=False)
+
+    def validate_screenings(self, screenings):
+        if len(screenings) > self.MAX_SCREENINGS:
+            raise serializers.ValidationError("At most {} screenings per season".format(self.MAX_SCREENINGS))
+        return screenings
+
+    def validate(self, data):
+        if data['last_date'] < data['first_date']:
+            raise serializers.ValidationError("last_date must not be before first_date")
+        return data
+
+
+class TicketOrderSerializer(serializers.Serializer):
+    MAX_QUANTITY = 100
+
+    screening = serializers.IntegerField()
+    date = serializers.DateField()
+    quantity = serializers.IntegerField(min_value=1, max_value=MAX_QUANTITY, default=1)
+
+
+class AvailabilityQuerySerializer(serializers.Serializer):
+    MAX_DAYS = 31
+
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    screening = serializers.ListField(child=serializers.IntegerField(), required=False)
+    room = serializers.IntegerField(required=False)
+    movie = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        data.setdefault('start', datetime.date.today())
+        data.setdefault('end', data['start'])
+        days = (data['end'] - data['start']).days + 1
+        if not 0 < days <= self.MAX_DAYS:
+            raise serializers.ValidationError("Date range must cover 1 to {} days".format(self.MAX_DAYS))
+        return data
+
+
+class OccupancyQuerySerializer(serializers.Serializer):
+    MAX_DAYS = 366
+
+    start = serializers.DateField()
+    end = serializers.DateField()
+    group = serializers.ListField(child=serializers.ChoiceField(GROUPS), default=lambda: ['date'])
+    room = serializers.IntegerField(required=False)
+    movie = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        days = (data['end'] - data['start']).days + 1
+        if not 0 < days <= self.MAX_DAYS:
+            raise serializers.ValidationError("Date range must cover 1 to {} days".format(self.MAX_DAYS))
+        return data
+
+
+class TicketExportQuerySerializer(serializers.Serializer):
+    start = serializers.DateField()
+    end = serializers.DateField()
+    output = serializers.ChoiceField(FORMATS, default='ndjson')
+
+    def validate(self, data):
+        if data['end'] < data['start']:
+            raise serializers.ValidationError("end must not be before start")
+        return data
+
+
+class ValuesSerializer(serializers.BaseSerializer):
+    """Read-only, list-only stand-in for a ModelSerializer of plain model fields.
+
+    Works on the .values() rows from rows() rather than model instances, and only
+    converts the fields whose output differs from the database value, with the
+    converters picked once. The output is what serializer_class(many=True) gives.
+    """
+    def __init__(self, serializer_class, instance=None, fields=None, **kwargs):
+        super().__init__(instance, **kwargs)
+        model = serializer_class.Meta.model
+        self.names = [name for name in serializer_class.Meta.fields if fields is None or name in fields]
+        # Rows always carry the id, cursor pagination reads it
+        self.columns = self.names if 'id' in self.names else ['id'] + self.names
+        self.converters = []
+        for name in self.names:
+            convert = VALUE_CONVERTERS.get(type(model._meta.get_field(name)))
+            if convert is not None:
+                self.converters.append((name, convert))
+
+    def rows(self, queryset):
+        return queryset.values(*self.columns)
 
+    def to_representation(self, rows):
+        with serializing():
+            for row in rows:
+                for name, convert in self.converters:
+                    if row[name] is not None:
+                        row[name] = convert(row[name])
+            if self.columns is not self.names:
+                # The paginator still needs the ids in the rows themselves
+                return [{name: row[name] for name in self.names} for row in rows]
+        return rows
@@ -0,0 +1,18 @@
+from .formats import write_records
+from .models import Ticket
+
+TICKET_FIELDS = ['id', 'date', 'screening', 'time', 'room', 'movie', 'title']
+
+
+def export_tickets(start, end, format):
+    """Yield every ticket dated start to end, with its screening, as text chunks.
+
+    Rows are read with a chunked server-side iterator in (date, id) order, which the
+    date index already provides, so memory use doesn't grow with the number of tickets.
+    """
+    rows = (Ticket.objects.filter(date__range=(start, end)).order_by('date', 'pk')
+            .values_list('pk', 'date', 'screening', 'screening__time', 'screening__room',
+                         'screening__movie', 'screening__movie__title')
+            .iterator(chunk_size=2000))
+    return write_records(TICKET_FIELDS, ((pk, str(date), screening, str(time), room, movie, title)
+                                         for pk, date, screening, time, room, movie, title in rows), format)
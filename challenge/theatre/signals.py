@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import invalidate
+from .models import Room, Movie, Screening, RoomSchedule
+
+CACHE_NAMESPACES = {
+    Room: 'rooms',
+    Movie: 'movies',
+    Screening: 'screenings',
+}
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+
+
+@receiver([post_save, post_delete])
+def invalidate_cached_responses(sender, **kwargs):
+    if sender in CACHE_NAMESPACES:
+        invalidate(CACHE_NAMESPACES[sender])
+
+
+@receiver(post_save, sender=Room)
+def create_room_schedule(sender, instance, created, **kwargs):
+    if created:
+        RoomSchedule.objects.create(room=instance)
+
+
+@receiver(pre_save, sender=Screening)
+def remember_previous_room(sender, instance, **kwargs):
+    instance._previous_room_id = None
+    if instance.pk is not None:
+        instance._previous_room_id = Screening.objects.filter(pk=instance.pk).values_list('room', flat=True).first()
+
+
+@receiver(post_save, sender=Screening)
+def update_room_schedules(sender, instance, **kwargs):
+    RoomSchedule.rebuild(instance.room_id)
+    if instance._previous_room_id not in (None, instance.room_id):
+        RoomSchedule.rebuild(instance._previous_room_id)
+
+
+def rebuild_deleted_rooms(connection):
+    room_ids, connection.deleted_screening_rooms = connection.deleted_screening_rooms, set()
+    RoomSchedule.rebuild_rooms(room_ids, create=False)
+
+
+@receiver(post_delete, sender=Screening)
+def remove_from_room_schedule(sender, instance, using, **kwargs):
+    # Deleting a room or movie deletes its screenings one at a time, so their rooms
+    # are collected per connection and rebuilt together once the deletes commit
+    connection = transaction.get_connection(using)
+    if not hasattr(connection, 'deleted_screening_rooms'):
+        connection.deleted_screening_rooms = set()
+    connection.deleted_screening_rooms.add(instance.room_id)
+    transaction.on_commit(lambda: rebuild_deleted_rooms(connection), using)
+
+
+@receiver(post_delete, sender=Room)
+def forget_deleted_room(sender, instance, using, **kwargs):
+    # Its schedule went with it, there's nothing to rebuild
+    connection = transaction.get_connection(using)
+    if hasattr(connection, 'deleted_screening_rooms'):
+        connection.deleted_screening_rooms.discard(instance.pk)
+
+
+@receiver(post_save, sender=Movie)
+def update_movie_schedules(sender, instance, created, **kwargs):
+    if not created:
+        RoomSchedule.rebuild_rooms(Screening.objects.filter(movie=instance).values_list('room', flat=True))
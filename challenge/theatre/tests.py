@@ -1,8 +1,23 @@
+import asyncio
+import collections
 import datetime
-from django.test import TestCase
-from django.db.utils import IntegrityError
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from unittest import mock
+from django.core.management import call_command, CommandError
+from django.core.cache import cache, caches
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db import connection, models, transaction
+from django.db.utils import IntegrityError, DatabaseError
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from .models import Room, Movie, Screening, Ticket
+from .models import Room, Movie, Screening, Ticket, SeatInventory, SeatsUnavailable, RoomSchedule, time_of_day, \
+    SeatHold, HoldExpired, ScreeningRule, EVERY_DAY, shift_run, weekday_bits, runs_share_date
 from rest_framework.test import APITestCase
 from rest_framework import status
 
@@ -60,6 +75,65 @@ class ScreeningModelTestCase(TestCase):
         self.assertFalse(screening.are_seats_remaining(self.tomorrow, current_time=self.current_time))
 
 
+class SeatInventoryTestCase(TestCase):
+    def setUp(self):
+        self.room = Room.objects.create(capacity=2)
+        self.movie = Movie.objects.create(title="blah")
+        self.screening = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=10))
+        self.date = datetime.date(year=2000, month=1, day=1)
+
+    def sold(self):
+        return SeatInventory.objects.get(screening=self.screening, date=self.date).sold
+
+    def test_ticket_counted_in_inventory(self):
+        Ticket.objects.create(screening=self.screening, date=self.date)
+        self.assertEqual(self.sold(), 1)
+
+    def test_cannot_save_ticket_when_sold_out(self):
+        Ticket.objects.create(screening=self.screening, date=self.date)
+        Ticket.objects.create(screening=self.screening, date=self.date)
+        with self.assertRaises(SeatsUnavailable):
+            Ticket.objects.create(screening=self.screening, date=self.date)
+        self.assertEqual(Ticket.objects.count(), 2)
+        self.assertEqual(self.sold(), 2)
+
+    def test_cannot_reserve_more_than_capacity(self):
+        self.assertFalse(self.screening.reserve_seats(self.date, quantity=3))
+        self.assertTrue(self.screening.reserve_seats(self.date, quantity=1))
+        self.assertFalse(self.screening.reserve_seats(self.date, quantity=2))
+        self.assertEqual(self.sold(), 1)
+
+    def test_deleting_ticket_releases_seat(self):
+        Ticket.objects.create(screening=self.screening, date=self.date)
+        ticket = Ticket.objects.create(screening=self.screening, date=self.date)
+        ticket.delete()
+        self.assertEqual(self.sold(), 1)
+
+    def test_room_capacity_change_updates_inventory(self):
+        Ticket.objects.create(screening=self.screening, date=self.date)
+        self.room.capacity = 5
+        self.room.save()
+        self.assertEqual(SeatInventory.objects.get().capacity, 5)
+
+    def test_purchase_does_not_count_tickets(self):
+        Ticket.objects.create(screening=self.screening, date=self.date)
+        with self.assertNumQueries(1):
+            self.screening.reserve_seats(self.date)
+
+    def test_failed_ticket_insert_releases_seat(self):
+        with mock.patch('django.db.models.Model.save', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                Ticket(screening=self.screening, date=self.date).save()
+        self.assertFalse(SeatInventory.objects.filter(sold__gt=0).exists())
+
+    def test_failed_ticket_delete_keeps_seat(self):
+        ticket = Ticket.objects.create(screening=self.screening, date=self.date)
+        with mock.patch('django.db.models.Model.delete', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                ticket.delete()
+        self.assertEqual(self.sold(), 1)
+
+
 class RoomApiTestCase(APITestCase):
 
     def test_successful_get_status(self):
@@ -208,6 +282,18 @@ class ScreeningApiTestCase(APITestCase):
         response = self.client.post(buy_ticket_url, data=self.data_for_ticket, format='json')
         self.assertTrue(status.is_client_error(response.status_code))
 
+    def test_buy_ticket_round_trips(self):
+        self.add_screening()
+        buy_ticket_url = reverse('screening-buyticket', args=['1'])
+        self.client.post(buy_ticket_url, data=self.data_for_ticket, format='json')
+        with CaptureQueriesContext(connection) as context:
+            self.client.post(buy_ticket_url, data=self.data_for_ticket, format='json')
+        # Fetch the screening, claim the seat, insert the ticket. The test case's own
+        # transaction turns the purchase's transaction into savepoints, skip those.
+        statements = [query['sql'].split()[0] for query in context.captured_queries
+                      if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(statements, ['SELECT', 'UPDATE', 'INSERT'])
+
     def test_no_ticket_for_bogus_date(self):
         bad_data_for_ticket = {'date': "asdfasdf"}
         self.add_screening()
@@ -216,6 +302,504 @@ class ScreeningApiTestCase(APITestCase):
         self.assertTrue(status.is_client_error(response.status_code))
 
 
+class BulkTicketApiTestCase(APITestCase):
+    def setUp(self):
+        self.room = Room.objects.create(capacity=10)
+        movie = Movie.objects.create(title="blah")
+        self.screening = Screening.objects.create(room=self.room, movie=movie, time=datetime.time(hour=5))
+        self.other_screening = Screening.objects.create(room=self.room, movie=movie, time=datetime.time(hour=10))
+        self.date = "{}".format(datetime.date.today() + datetime.timedelta(days=1))
+        self.url = reverse('screening-buytickets')
+
+    def buy(self, *items):
+        items = [{'screening': screening.pk, 'date': self.date, 'quantity': quantity} for screening, quantity in items]
+        return self.client.post(self.url, {'items': items}, format='json')
+
+    def test_buy_several_tickets(self):
+        response = self.buy((self.screening, 8))
+        self.assertTrue(status.is_success(response.status_code))
+        self.assertEqual(len(response.data), 8)
+        self.assertEqual(len({ticket['id'] for ticket in response.data}), 8)
+        self.assertEqual(set(Ticket.objects.values_list('pk', flat=True)), {ticket['id'] for ticket in response.data})
+
+    def test_buy_for_several_screenings(self):
+        response = self.buy((self.screening, 2), (self.other_screening, 3))
+        self.assertTrue(status.is_success(response.status_code))
+        self.assertEqual(Ticket.objects.filter(screening=self.screening).count(), 2)
+        self.assertEqual(Ticket.objects.filter(screening=self.other_screening).count(), 3)
+
+    def test_order_is_all_or_nothing(self):
+        response = self.buy((self.screening, 2), (self.other_screening, 11))
+        self.assertTrue(status.is_client_error(response.status_code))
+        self.assertEqual(Ticket.objects.count(), 0)
+        self.assertFalse(SeatInventory.objects.filter(sold__gt=0).exists())
+
+    def test_items_for_same_screening_share_capacity(self):
+        response = self.buy((self.screening, 6), (self.screening, 6))
+        self.assertTrue(status.is_client_error(response.status_code))
+        self.assertEqual(Ticket.objects.count(), 0)
+
+    def test_unknown_screening(self):
+        response = self.client.post(self.url, {'items': [{'screening': 999, 'date': self.date}]}, format='json')
+        self.assertTrue(status.is_client_error(response.status_code))
+
+    def test_body_must_hold_items(self):
+        for body in ('"items"', '7'):
+            response = self.client.post(self.url, body, content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bogus_quantity(self):
+        response = self.buy((self.screening, 0))
+        self.assertTrue(status.is_client_error(response.status_code))
+        response = self.buy((self.screening, 10 ** 20))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(SeatInventory.objects.filter(sold__gt=0).exists())
+
+    def test_queries_do_not_grow_with_quantity(self):
+        self.buy((self.screening, 1))  # First sale of the date creates the inventory row
+        with CaptureQueriesContext(connection) as one:
+            self.buy((self.screening, 1))
+        with CaptureQueriesContext(connection) as eight:
+            self.buy((self.screening, 8))
+        self.assertEqual(len(one.captured_queries), len(eight.captured_queries))
+
+
+class AvailabilityApiTestCase(APITestCase):
+    def setUp(self):
+        self.room = Room.objects.create(capacity=10)
+        self.movie = Movie.objects.create(title="blah")
+        self.screening = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=5))
+        self.tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        self.url = reverse('screening-availability')
+
+    def availability(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertTrue(status.is_success(response.status_code))
+        return {(row['screening'], row['date']): row['remaining'] for row in response.data}
+
+    def test_remaining_seats(self):
+        self.screening.sell_tickets(self.tomorrow, 3)
+        day_after = self.tomorrow + datetime.timedelta(days=1)
+        availability = self.availability(start=self.tomorrow, end=day_after)
+        self.assertEqual(availability, {(self.screening.pk, self.tomorrow): 7, (self.screening.pk, day_after): 10})
+
+    def test_started_screening_has_no_seats(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        self.assertEqual(self.availability(start=yesterday), {(self.screening.pk, yesterday): 0})
+
+    def test_filter_by_screening(self):
+        other = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=10))
+        Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=15))
+        availability = self.availability(start=self.tomorrow, screening=[self.screening.pk, other.pk])
+        self.assertEqual(set(availability), {(self.screening.pk, self.tomorrow), (other.pk, self.tomorrow)})
+
+    def test_date_range_is_bounded(self):
+        end = self.tomorrow + datetime.timedelta(days=100)
+        response = self.client.get(self.url, {'start': self.tomorrow, 'end': end})
+        self.assertTrue(status.is_client_error(response.status_code))
+
+    def test_end_before_start(self):
+        response = self.client.get(self.url, {'start': self.tomorrow, 'end': datetime.date.today()})
+        self.assertTrue(status.is_client_error(response.status_code))
+
+    def test_queries_do_not_grow_with_screenings(self):
+        with CaptureQueriesContext(connection) as few:
+            self.availability(start=self.tomorrow)
+        for hour in range(6, 20):
+            screening = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=hour))
+            screening.sell_tickets(self.tomorrow)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(len(self.availability(start=self.tomorrow)), 15)
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+
+class ListPaginationTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()  # bulk_create doesn't send the signals that invalidate cached listings
+        Movie.objects.bulk_create(Movie(title="movie {}".format(number)) for number in range(25))
+
+    def test_pages_cover_every_row(self):
+        url = reverse('movie-list') + '?page_size=10'
+        titles = []
+        while url:
+            response = self.client.get(url)
+            self.assertLessEqual(len(response.data['results']), 10)
+            titles.extend(movie['title'] for movie in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(titles, ["movie {}".format(number) for number in range(25)])
+
+    def test_sparse_fields(self):
+        response = self.client.get(reverse('movie-list'), {'fields': 'id,title'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title'})
+
+    def test_sparse_fields_on_detail(self):
+        movie = Movie.objects.first()
+        response = self.client.get(reverse('movie-detail', args=[movie.pk]), {'fields': 'length'})
+        self.assertEqual(response.data, {'length': '01:30:00'})
+
+    def test_unknown_fields_ignored(self):
+        response = self.client.get(reverse('room-list'), {'fields': 'capacity,bogus'})
+        self.assertTrue(status.is_success(response.status_code))
+
+
+class ValuesSerializerTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.room = Room.objects.create(capacity=10)
+        Movie.objects.create(title="short", length=datetime.timedelta(minutes=1, microseconds=5))
+        self.movie = Movie.objects.create(title="long", length=datetime.timedelta(days=1, hours=2))
+        rule = ScreeningRule.objects.create(first_date=datetime.date(2030, 1, 1), last_date=datetime.date(2030, 1, 31))
+        Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=9, second=30), rule=rule)
+        Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=20, microsecond=10))
+
+    def test_lists_match_model_serializers(self):
+        from .serializers import RoomSerializer, MovieSerializer, ScreeningSerializer
+        for name, serializer_class in (('room', RoomSerializer), ('movie', MovieSerializer),
+                                       ('screening', ScreeningSerializer)):
+            with self.subTest(name):
+                expected = serializer_class(serializer_class.Meta.model.objects.order_by('pk'), many=True).data
+                self.assertEqual(self.client.get(reverse(name + '-list')).data['results'], expected)
+
+    def test_tickets_match_model_serializers(self):
+        from .serializers import ValuesSerializer, TicketSerializer, QueuedTicketSerializer
+        Ticket.objects.bulk_create([Ticket(screening=Screening.objects.first(), date=datetime.date(2030, 1, 2)),
+                                    Ticket(screening=Screening.objects.first(), date=datetime.date(2030, 1, 2),
+                                           seat=3, receipt='c5f1a7b6-8f0c-4b7e-9a1e-3a3c2f0e1d00')])
+        tickets = Ticket.objects.order_by('pk')
+        for serializer_class in (TicketSerializer, QueuedTicketSerializer):
+            with self.subTest(serializer_class.__name__):
+                serializer = ValuesSerializer(serializer_class)
+                self.assertEqual(serializer.to_representation(list(serializer.rows(tickets))),
+                                 serializer_class(tickets, many=True).data)
+
+    def test_sparse_fields_without_id_still_page(self):
+        response = self.client.get(reverse('movie-list'), {'fields': 'length', 'page_size': 1})
+        self.assertEqual(response.data['results'], [{'length': '00:01:00.000005'}])
+        self.assertEqual(self.client.get(response.data['next']).data['results'], [{'length': '1 02:00:00'}])
+
+
+class ExpandedScreeningApiTestCase(APITestCase):
+    def add_screenings(self, count):
+        for _ in range(count):
+            room = Room.objects.create(capacity=20)
+            movie = Movie.objects.create(title="blah")
+            Screening.objects.create(room=room, movie=movie, time=datetime.time(hour=5))
+
+    def test_expanded_screening(self):
+        self.add_screenings(1)
+        screening = Screening.objects.get()
+        response = self.client.get(reverse('screening-detail', args=[screening.pk]), {'expand': 'true'})
+        self.assertEqual(response.data['movie'], {'id': screening.movie_id, 'title': 'blah', 'length': '01:30:00'})
+        self.assertEqual(response.data['room'], {'id': screening.room_id, 'capacity': 20})
+
+    def test_not_expanded_by_default(self):
+        self.add_screenings(1)
+        response = self.client.get(reverse('screening-list'))
+        self.assertEqual(response.data['results'][0]['movie'], Movie.objects.get().pk)
+
+    def test_expanded_list_queries_do_not_grow_with_rows(self):
+        for count in (3, 30):
+            self.add_screenings(count)
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('screening-list'), {'expand': '1'})
+            self.assertEqual(len(response.data['results']), Screening.objects.count())
+
+
+class CachedResponseTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.room = Room.objects.create(capacity=20)
+        self.movie = Movie.objects.create(title="blah")
+
+    def test_repeat_read_skips_database(self):
+        self.client.get(reverse('room-list'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('room-list'))
+        self.assertEqual(response.data['results'], [{'id': self.room.pk, 'capacity': 20}])
+
+    def test_evicted_generation_does_not_revive_old_payloads(self):
+        from .cache import generation_key
+        self.client.get(reverse('room-list'))
+        Room.objects.create(capacity=5)
+        self.client.get(reverse('room-list'))
+        cache.delete(generation_key('rooms'))
+        Room.objects.create(capacity=5)
+        self.assertEqual(len(self.client.get(reverse('room-list')).data['results']), 3)
+
+    def test_create_invalidates(self):
+        self.client.get(reverse('room-list'))
+        self.client.post(reverse('room-list'), {'capacity': 5}, format='json')
+        response = self.client.get(reverse('room-list'))
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_update_invalidates_detail(self):
+        url = reverse('movie-detail', args=[self.movie.pk])
+        self.client.get(url)
+        self.client.patch(url, {'title': 'new title'}, format='json')
+        self.assertEqual(self.client.get(url).data['title'], 'new title')
+
+    def test_delete_invalidates(self):
+        self.client.get(reverse('movie-list'))
+        self.client.delete(reverse('movie-detail', args=[self.movie.pk]))
+        self.assertEqual(self.client.get(reverse('movie-list')).data['results'], [])
+
+    def test_movie_change_invalidates_expanded_screenings(self):
+        Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=5))
+        self.client.get(reverse('screening-list'), {'expand': 'true'})
+        self.movie.title = 'new title'
+        self.movie.save()
+        response = self.client.get(reverse('screening-list'), {'expand': 'true'})
+        self.assertEqual(response.data['results'][0]['movie']['title'], 'new title')
+
+    def test_conditional_get(self):
+        etag = self.client.get(reverse('room-list'))['ETag']
+        response = self.client.get(reverse('room-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        Room.objects.create(capacity=5)
+        response = self.client.get(reverse('room-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_detail_not_cached(self):
+        url = reverse('room-detail', args=[999])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        Room.objects.bulk_create([Room(pk=999, capacity=5)])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+
+class RoomScheduleTestCase(APITestCase):
+    def setUp(self):
+        self.room = Room.objects.create(capacity=20)
+        self.movie = Movie.objects.create(title="blah", length=datetime.timedelta(hours=2))
+
+    def timeline(self, room=None):
+        return RoomSchedule.objects.get(room=room or self.room).timeline()
+
+    def test_schedule_in_start_order(self):
+        late = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=23))
+        early = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=9))
+        self.assertEqual(self.timeline(), [
+            {'screening': early.pk, 'movie': self.movie.pk, 'title': 'blah', 'start': '09:00:00', 'end': '11:00:00'},
+            {'screening': late.pk, 'movie': self.movie.pk, 'title': 'blah', 'start': '23:00:00', 'end': '01:00:00'},
+        ])
+
+    def test_moving_screening_updates_both_rooms(self):
+        other_room = Room.objects.create(capacity=20)
+        screening = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=9))
+        screening.room = other_room
+        screening.save()
+        self.assertEqual(self.timeline(), [])
+        self.assertEqual([entry['screening'] for entry in self.timeline(other_room)], [screening.pk])
+
+    def test_movie_change_updates_schedule(self):
+        Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=9))
+        self.movie.title = 'new title'
+        self.movie.length = datetime.timedelta(hours=1)
+        self.movie.save()
+        self.assertEqual((self.timeline()[0]['title'], self.timeline()[0]['end']), ('new title', '10:00:00'))
+
+    def test_schedule_endpoint(self):
+        Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=9))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('room-schedule', args=[self.room.pk]))
+        self.assertEqual(response.data['room'], self.room.pk)
+        self.assertEqual(response.data['screenings'], self.timeline())
+
+    def test_schedule_for_unknown_room(self):
+        response = self.client.get(reverse('room-schedule', args=[999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_all_schedules(self):
+        Room.objects.create(capacity=20)
+        response = self.client.get(reverse('room-schedules'))
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class CatalogTransferTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.room = Room.objects.create(capacity=20)
+        self.movie = Movie.objects.create(title="blah", length=datetime.timedelta(hours=1))
+
+    def import_records(self, kind, records):
+        body = ''.join(json.dumps(record) + '\n' for record in records)
+        return self.client.post(reverse('{}-import'.format(kind)), body, content_type='application/x-ndjson')
+
+    def screening(self, time, room=None):
+        return {'room': (room or self.room).pk, 'movie': self.movie.pk, 'time': time}
+
+    def test_import_rooms(self):
+        response = self.import_records('room', [{'capacity': 5}, {'capacity': 10}])
+        self.assertEqual(response.data, {'imported': 2})
+        self.assertEqual(sorted(Room.objects.values_list('capacity', flat=True)), [5, 10, 20])
+        self.assertEqual(RoomSchedule.objects.count(), 3)
+
+    def test_import_movies_csv(self):
+        body = 'title,length\nfirst,02:00:00\nsecond,\n'
+        response = self.client.post(reverse('movie-import'), body, content_type='text/csv')
+        self.assertEqual(response.data, {'imported': 2})
+        self.assertEqual(Movie.objects.get(title='first').length, datetime.timedelta(hours=2))
+        self.assertEqual(Movie.objects.get(title='second').length, datetime.timedelta(minutes=90))
+
+    def test_import_screenings(self):
+        response = self.import_records('screening', [self.screening('10:00:00'), self.screening('11:00:00')])
+        self.assertEqual(response.data, {'imported': 2})
+        screening = Screening.objects.get(time=datetime.time(hour=11))
+        self.assertEqual((screening.start_offset, screening.end_offset), (11 * 3600, 12 * 3600))
+        self.assertEqual(len(RoomSchedule.objects.get(room=self.room).timeline()), 2)
+
+    def test_import_rejects_overlap_within_batch(self):
+        response = self.import_records('screening', [self.screening('10:00:00'), self.screening('10:30:00')])
+        self.assertTrue(status.is_client_error(response.status_code))
+        self.assertEqual(len(response.data['errors']), 2)
+        self.assertFalse(Screening.objects.exists())
+
+    def test_import_rejects_overlap_with_database(self):
+        Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=23, minute=30))
+        other_room = Room.objects.create(capacity=20)
+        response = self.import_records('screening', [self.screening('00:15:00'), self.screening('00:15:00', other_room)])
+        self.assertEqual(response.data['errors'], ['Line 1: overlaps another screening'])
+        self.assertEqual(Screening.objects.count(), 1)
+
+    def test_import_rejects_bad_records(self):
+        response = self.import_records('screening', [self.screening('noon'), {'room': 999, 'movie': 1, 'time': '10:00'}])
+        self.assertEqual(len(response.data['errors']), 1)
+        response = self.import_records('screening', [{'room': 999, 'movie': self.movie.pk, 'time': '10:00'}])
+        self.assertEqual(response.data['errors'], ['Unknown room 999'])
+        self.assertFalse(Screening.objects.exists())
+
+    def test_import_rejects_out_of_range_numbers(self):
+        response = self.import_records('room', [{'capacity': 10 ** 30}, {'id': 10 ** 30, 'capacity': 5},
+                                                {'capacity': -1}])
+        self.assertEqual(len(response.data['errors']), 3)
+        response = self.import_records('movie', [{'title': 'backwards', 'length': '-01:00:00'},
+                                                 {'title': 'endless', 'length': '999999999 00:00:00'},
+                                                 {'title': 'too long', 'length': '9999999999 00:00:00'}])
+        self.assertEqual(len(response.data['errors']), 3)
+        self.assertEqual((Room.objects.count(), Movie.objects.count()), (1, 1))
+
+    def test_import_invalidates_cached_listing(self):
+        self.client.get(reverse('room-list'))
+        self.import_records('room', [{'capacity': 5}])
+        self.assertEqual(len(self.client.get(reverse('room-list')).data['results']), 2)
+
+    def test_export_round_trip(self):
+        Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=10))
+        for output in ('ndjson', 'csv'):
+            response = self.client.get(reverse('movie-export'), {'output': output})
+            body = b''.join(response.streaming_content).decode()
+            content_type = 'text/csv' if output == 'csv' else 'application/x-ndjson'
+            Movie.objects.all().delete()
+            response = self.client.post(reverse('movie-import'), body, content_type=content_type)
+            self.assertEqual(response.data, {'imported': 1})
+            self.assertEqual(list(Movie.objects.values_list('id', 'title', 'length')),
+                             [(self.movie.pk, 'blah', datetime.timedelta(hours=1))])
+
+    def test_export_screenings(self):
+        screening = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=10))
+        response = self.client.get(reverse('screening-export'))
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(records, [{'id': screening.pk, 'room': self.room.pk, 'movie': self.movie.pk,
+                                    'time': '10:00:00'}])
+
+    def test_management_commands(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rooms.csv')
+            call_command('export_catalog', 'rooms', output=path)
+            Room.objects.all().delete()
+            call_command('import_catalog', 'rooms', path, stdout=io.StringIO())
+        self.assertEqual(list(Room.objects.values_list('id', 'capacity')), [(self.room.pk, 20)])
+        with self.assertRaises(CommandError):
+            call_command('import_catalog', 'rooms', path + '.missing', stdout=io.StringIO())
+
+
+class RoomScheduleDeleteTestCase(TransactionTestCase):
+    # Deleted screenings leave their schedules once the delete commits
+    def setUp(self):
+        self.room = Room.objects.create(capacity=20)
+        self.movie = Movie.objects.create(title="blah", length=datetime.timedelta(hours=2))
+
+    def timeline(self, room=None):
+        return RoomSchedule.objects.get(room=room or self.room).timeline()
+
+    def screenings(self, count):
+        rooms = [Room.objects.create(capacity=20) for _ in range(count)]
+        for room in rooms:
+            Screening.objects.create(room=room, movie=self.movie, time=datetime.time(hour=9))
+        return rooms
+
+    def test_deleted_screening_removed(self):
+        screening = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=9))
+        screening.delete()
+        self.assertEqual(self.timeline(), [])
+
+    def test_delete_room_with_screenings(self):
+        Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=9))
+        self.room.delete()
+        self.assertFalse(RoomSchedule.objects.exists())
+
+    def test_delete_movie_rebuilds_each_room_once(self):
+        other = Movie.objects.create(title="other")
+        Screening.objects.create(room=self.room, movie=other, time=datetime.time(hour=20))
+        queries = {}
+        for count in (1, 5):
+            rooms = self.screenings(count)
+            with CaptureQueriesContext(connection) as captured:
+                self.movie.delete()
+            queries[count] = len(captured)
+            for room in rooms:
+                self.assertEqual(self.timeline(room), [])
+            self.movie = Movie.objects.create(title="blah", length=datetime.timedelta(hours=2))
+        self.assertEqual(queries[1], queries[5])
+        self.assertEqual([entry['title'] for entry in self.timeline()], ['other'])
+
+    def test_delete_room_skips_its_schedule(self):
+        room = self.screenings(1)[0]
+        Screening.objects.create(room=room, movie=self.movie, time=datetime.time(hour=20))
+        with mock.patch.object(RoomSchedule, '_rebuild_batch') as rebuild:
+            room.delete()
+        rebuild.assert_not_called()
+
+
+class TicketExportTestCase(APITestCase):
+    def setUp(self):
+        self.room = Room.objects.create(capacity=20)
+        self.movie = Movie.objects.create(title="blah")
+        self.screening = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=10))
+        self.date = datetime.date(year=2030, month=1, day=1)
+        self.tickets = self.screening.sell_tickets(self.date, 2)
+        self.screening.sell_tickets(self.date + datetime.timedelta(days=1))
+        self.screening.sell_tickets(self.date + datetime.timedelta(days=5))
+
+    def export(self, **params):
+        params.setdefault('start', self.date)
+        params.setdefault('end', self.date + datetime.timedelta(days=1))
+        response = self.client.get(reverse('ticket-export'), params)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_ndjson(self):
+        records = [json.loads(line) for line in self.export(end=self.date).splitlines()]
+        self.assertEqual(records, [{'id': ticket.pk, 'date': '2030-01-01', 'screening': self.screening.pk,
+                                    'time': '10:00:00', 'room': self.room.pk, 'movie': self.movie.pk,
+                                    'title': 'blah'} for ticket in self.tickets])
+
+    def test_export_csv_date_range(self):
+        lines = self.export(output='csv').splitlines()
+        self.assertEqual(lines[0], 'id,date,screening,time,room,movie,title')
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['2030-01-01', '2030-01-01', '2030-01-02'])
+
+    def test_export_requires_valid_range(self):
+        response = self.client.get(reverse('ticket-export'), {'start': self.date, 'end': '2029-01-01'})
+        self.assertTrue(status.is_client_error(response.status_code))
+        response = self.client.get(reverse('ticket-export'), {'start': self.date})
+        self.assertTrue(status.is_client_error(response.status_code))
+
+    def test_management_command(self):
+        output = io.StringIO()
+        call_command('export_tickets', '2030-01-01', '2030-12-31', stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), 4)
+
+
 class ScreeningOverlapTestCase(APITestCase):
     def setUp(self):
         self.room = Room(capacity=20)
@@ -266,3 +850,824 @@ class ScreeningOverlapTestCase(APITestCase):
         screening_two = Screening(room=self.room, movie=self.second_movie, time=datetime.time(hour=6))
         self.assertTrue(screening_two.overlaps(screening_one))
 
+    # movie 1:             |=====|  (23:30 - 00:30)
+    # movie 2:  |=====|             (00:00 - 01:00)
+    def test_overlap_past_midnight_fails(self):
+        screening_one = Screening(room=self.room, movie=self.first_movie, time=datetime.time(hour=23, minute=30))
+        screening_two = Screening(room=self.room, movie=self.second_movie, time=datetime.time(hour=0))
+        self.assertTrue(screening_one.overlaps(screening_two))
+        self.assertTrue(screening_two.overlaps(screening_one))
+
+    def test_overlapping_query_matches_overlaps(self):
+        times = [datetime.time(hour=0), datetime.time(hour=5, minute=30), datetime.time(hour=7),
+                 datetime.time(hour=23, minute=30)]
+        existing = [Screening.objects.create(room=self.room, movie=self.first_movie, time=time) for time in times]
+        for hour in range(24):
+            for minute in (0, 15, 45):
+                proposed = Screening(room=self.room, movie=self.second_movie, time=datetime.time(hour, minute))
+                expected = {screening.pk for screening in existing if proposed.overlaps(screening)}
+                found = set(Screening.objects.overlapping(proposed).values_list('pk', flat=True))
+                self.assertEqual(expected, found)
+
+    def test_overlapping_query_scoped_to_room(self):
+        other_room = Room.objects.create(capacity=20)
+        Screening.objects.create(room=other_room, movie=self.first_movie, time=datetime.time(hour=5))
+        proposed = Screening(room=self.room, movie=self.second_movie, time=datetime.time(hour=5))
+        self.assertFalse(Screening.objects.overlapping(proposed).exists())
+
+    def test_overlapping_query_excludes_itself(self):
+        screening = Screening.objects.create(room=self.room, movie=self.first_movie, time=datetime.time(hour=5))
+        self.assertFalse(Screening.objects.overlapping(screening).exists())
+
+    def test_bounds_follow_movie_length(self):
+        screening = Screening.objects.create(room=self.room, movie=self.first_movie, time=datetime.time(hour=5))
+        self.first_movie.length = datetime.timedelta(hours=2)
+        self.first_movie.save()
+        screening.refresh_from_db()
+        self.assertEqual((screening.start_offset, screening.end_offset), (5 * 3600, 7 * 3600))
+
+    def test_same_time_in_other_room_is_fine(self):
+        other_room = Room.objects.create(capacity=20)
+        Screening.objects.create(room=self.room, movie=self.first_movie, time=datetime.time(hour=5))
+        data = {'movie': self.second_movie.pk, 'room': other_room.pk, 'time': '05:00:00'}
+        response = self.client.post(reverse('screening-list'), data, format='json')
+        self.assertTrue(status.is_success(response.status_code))
+
+    def test_cannot_add_screening_overlapping_past_midnight(self):
+        Screening.objects.create(room=self.room, movie=self.first_movie, time=datetime.time(hour=23, minute=30))
+        data = {'movie': self.second_movie.pk, 'room': self.room.pk, 'time': '00:15:00'}
+        response = self.client.post(reverse('screening-list'), data, format='json')
+        self.assertTrue(status.is_client_error(response.status_code))
+
+
+class ScreeningRuleTestCase(APITestCase):
+    # 2030-01-04 is a Friday
+    FRIDAY = datetime.date(2030, 1, 4)
+
+    def setUp(self):
+        self.room = Room.objects.create(capacity=20)
+        self.movie = Movie.objects.create(title="blah", length=datetime.timedelta(minutes=90))
+
+    def day(self, days):
+        return self.FRIDAY + datetime.timedelta(days=days)
+
+    def season(self, weekdays, *times, first=0, last=27):
+        data = {'first_date': self.day(first), 'last_date': self.day(last), 'weekdays': weekdays,
+                'screenings': [{'room': self.room.pk, 'movie': self.movie.pk, 'time': time} for time in times]}
+        return self.client.post(reverse('screening-season'), data, format='json')
+
+    def test_runs_share_date(self):
+        fridays = (self.day(0), self.day(27), weekday_bits([4]))
+        self.assertTrue(runs_share_date(fridays, EVERY_DAY))
+        self.assertFalse(runs_share_date(fridays, (None, None, weekday_bits([5]))))
+        self.assertTrue(runs_share_date(shift_run(fridays, 1), (None, None, weekday_bits([5]))))
+        self.assertFalse(runs_share_date(fridays, (self.day(28), None, EVERY_DAY[2])))
+        self.assertFalse(runs_share_date(fridays, (self.day(1), self.day(6), EVERY_DAY[2])))
+
+    def test_season_creates_screenings_under_one_rule(self):
+        response = self.season([4, 5], '10:00', '20:00')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['rule']['weekdays'], [4, 5])
+        rule = ScreeningRule.objects.get()
+        self.assertEqual(sorted(rule.screenings.values_list('time', flat=True)),
+                         [datetime.time(hour=10), datetime.time(hour=20)])
+        entry = RoomSchedule.objects.get(room=self.room).timeline()[0]
+        self.assertEqual((entry['first_date'], entry['last_date'], entry['weekdays']), ('2030-01-04', '2030-01-31', [4, 5]))
+
+    def test_seasons_on_other_weekdays_share_times(self):
+        self.assertEqual(self.season([4], '10:00').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.season([5], '10:00').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.season([4], '10:00', first=28, last=40).status_code, status.HTTP_201_CREATED)
+
+    def test_season_conflicts_are_reported_and_nothing_is_created(self):
+        Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=11))
+        response = self.season([4], '08:00', '10:00', '10:30')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'], ['Screening 2: overlaps another screening',
+                                                   'Screening 3: overlaps another screening'])
+        self.assertFalse(ScreeningRule.objects.exists())
+        self.assertEqual(Screening.objects.count(), 1)
+
+    def test_season_conflict_past_midnight(self):
+        self.assertEqual(self.season([4], '23:30').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.season([6], '00:15').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.season([5], '00:15').status_code, status.HTTP_400_BAD_REQUEST)
+        data = {'movie': self.movie.pk, 'room': self.room.pk, 'time': '00:30:00'}
+        response = self.client.post(reverse('screening-list'), data, format='json')
+        self.assertTrue(status.is_client_error(response.status_code))
+
+    def test_season_validation(self):
+        self.assertEqual(self.season([4], '10:00', first=5, last=4).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.season([7], '10:00').status_code, status.HTTP_400_BAD_REQUEST)
+        room = self.room.pk
+        self.room.delete()
+        self.room.pk = room
+        self.assertEqual(self.season([4], '10:00').data['errors'], ['Unknown room {}'.format(room)])
+
+    def test_tickets_only_on_run_dates(self):
+        self.season([4], '10:00')
+        screening = Screening.objects.get()
+        url = reverse('screening-buyticket', args=[screening.pk])
+        self.assertEqual(self.client.post(url, {'date': '2030-01-11'}).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post(url, {'date': '2030-01-12'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(url, {'date': '2030-02-01'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_availability_skips_dates_off_the_run(self):
+        self.season([4, 5], '10:00', first=0, last=7)
+        screening = Screening.objects.get()
+        response = self.client.get(reverse('screening-availability'), {'start': self.day(0), 'end': self.day(9)})
+        self.assertEqual([row['date'] for row in response.data if row['screening'] == screening.pk],
+                         [self.day(0), self.day(1), self.day(7)])
+
+    def test_schedule_for_date(self):
+        self.season([4], '10:00')
+        daily = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=15))
+        url = reverse('room-schedule', args=[self.room.pk])
+        friday = self.client.get(url, {'date': '2030-01-11'}).data['screenings']
+        saturday = self.client.get(url, {'date': '2030-01-12'}).data['screenings']
+        self.assertEqual(len(friday), 2)
+        self.assertEqual([entry['screening'] for entry in saturday], [daily.pk])
+        self.assertEqual(self.client.get(url, {'date': 'soon'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class OccupancyReportTestCase(APITestCase):
+    # 2030-01-04 is a Friday
+    FRIDAY = datetime.date(2030, 1, 4)
+    SATURDAY = datetime.date(2030, 1, 5)
+
+    def setUp(self):
+        self.big = Room.objects.create(capacity=10)
+        self.small = Room.objects.create(capacity=4)
+        self.first_movie = Movie.objects.create(title="first")
+        self.second_movie = Movie.objects.create(title="second")
+        self.first = Screening.objects.create(room=self.big, movie=self.first_movie, time=datetime.time(hour=10))
+        self.second = Screening.objects.create(room=self.small, movie=self.second_movie, time=datetime.time(hour=10))
+        self.third = Screening.objects.create(room=self.small, movie=self.first_movie, time=datetime.time(hour=15))
+        self.first.sell_tickets(self.FRIDAY, 3)
+        self.second.sell_tickets(self.FRIDAY, 2)
+        self.third.sell_tickets(self.SATURDAY, 1)
+        self.url = reverse('report-occupancy')
+
+    def report(self, **params):
+        params.setdefault('start', self.FRIDAY)
+        params.setdefault('end', self.SATURDAY)
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_occupancy_by_movie(self):
+        self.assertEqual(self.report(group='movie'), [
+            {'movie': self.first_movie.pk, 'sold': 4, 'capacity': 28, 'occupancy': 0.1429},
+            {'movie': self.second_movie.pk, 'sold': 2, 'capacity': 8, 'occupancy': 0.25},
+        ])
+
+    def test_held_seats_are_not_sold(self):
+        self.third.hold_seats(self.FRIDAY, [0, 1])
+        self.assertEqual(self.report(), [
+            {'date': self.FRIDAY, 'sold': 5, 'capacity': 18, 'occupancy': 0.2778},
+            {'date': self.SATURDAY, 'sold': 1, 'capacity': 18, 'occupancy': 0.0556},
+        ])
+
+    def test_groups_and_filters_combine(self):
+        rows = self.report(group=['date', 'room'], room=self.small.pk, end=self.FRIDAY)
+        self.assertEqual(rows, [{'room': self.small.pk, 'date': self.FRIDAY, 'sold': 2, 'capacity': 8,
+                                 'occupancy': 0.25}])
+        self.assertEqual([row['sold'] for row in self.report(movie=self.second_movie.pk)], [2, 0])
+
+    def test_seasons_only_offer_seats_on_their_dates(self):
+        rule = ScreeningRule.objects.create(first_date=self.FRIDAY, last_date=self.FRIDAY)
+        Screening.objects.create(room=self.big, movie=self.second_movie, time=datetime.time(hour=20), rule=rule)
+        self.assertEqual([row['capacity'] for row in self.report(movie=self.second_movie.pk)], [14, 4])
+
+    def test_queries_do_not_grow_with_sales(self):
+        with CaptureQueriesContext(connection) as few:
+            self.report(group=['movie', 'room', 'date'])
+        for hour in range(16, 22):
+            screening = Screening.objects.create(room=self.big, movie=self.second_movie, time=datetime.time(hour=hour))
+            screening.sell_tickets(self.FRIDAY, 2)
+            screening.hold_seats(self.SATURDAY, [0])
+        with CaptureQueriesContext(connection) as many:
+            self.report(group=['movie', 'room', 'date'])
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+    def test_validation(self):
+        response = self.client.get(self.url, {'start': self.SATURDAY, 'end': self.FRIDAY})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'start': self.FRIDAY, 'end': self.FRIDAY, 'group': 'title'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsgiApplicationTestCase(TransactionTestCase):
+    # Database work runs on other threads, so the data has to be committed
+    def setUp(self):
+        from .asgi import TheatreApplication
+        cache.clear()
+        self.application = TheatreApplication()
+        self.room = Room.objects.create(capacity=1)
+        self.movie = Movie.objects.create(title="blah")
+        self.screening = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=10))
+        self.tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+
+    def call(self, method, path, query_string=b'', body=b'', headers=()):
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+            'headers': [(b'content-type', b'application/json')] + list(headers), 'http_version': '1.1',
+            'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 0), 'root_path': '',
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(self.application(scope, receive, send))
+        self.response_headers = dict(messages[0]['headers'])
+        return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
+
+    def test_buy_ticket(self):
+        path = '/screenings/{}/buyticket/'.format(self.screening.pk)
+        body = json.dumps({'date': str(self.tomorrow)}).encode()
+        status_code, content = self.call('POST', path, body=body)
+        self.assertEqual(status_code, 200)
+        self.assertEqual(json.loads(content)['screening'], self.screening.pk)
+        status_code, content = self.call('POST', path, body=body)
+        self.assertEqual(status_code, 400)
+        self.assertEqual(content, b"Unable to purchase ticket for specified screening")
+        self.assertEqual(Ticket.objects.count(), 1)
+
+    def test_buy_ticket_idempotency_key(self):
+        caches['idempotency'].clear()
+        path = '/screenings/{}/buyticket/'.format(self.screening.pk)
+        body = json.dumps({'date': str(self.tomorrow)}).encode()
+        headers = [(b'idempotency-key', b'retry-me')]
+        first = self.call('POST', path, body=body, headers=headers)
+        self.assertNotIn(b'idempotent-replayed', self.response_headers)
+        self.assertEqual(self.call('POST', path, body=body, headers=headers), first)
+        self.assertEqual(self.response_headers[b'idempotent-replayed'], b'true')
+        self.assertEqual(first[0], 200)
+        self.assertEqual(Ticket.objects.count(), 1)
+
+    def test_buy_ticket_errors(self):
+        path = '/screenings/{}/buyticket/'.format(self.screening.pk)
+        status_code, content = self.call('POST', path, body=b'{"date": "tomorrow"}')
+        self.assertEqual(status_code, 400)
+        self.assertEqual(content, b"Improper format for requested date")
+        status_code, _ = self.call('POST', '/screenings/0/buyticket/', body=b'{}')
+        self.assertEqual(status_code, 404)
+
+    def test_availability_matches_wsgi(self):
+        query = 'start={0}&end={0}'.format(self.tomorrow)
+        status_code, content = self.call('GET', '/screenings/availability/', query_string=query.encode())
+        self.assertEqual(status_code, 200)
+        response = self.client.get('/screenings/availability/?' + query)
+        self.assertEqual(json.loads(content), response.json())
+        status_code, _ = self.call('GET', '/screenings/availability/', query_string=b'start=soon')
+        self.assertEqual(status_code, 400)
+
+    def test_other_requests_use_wsgi(self):
+        status_code, content = self.call('GET', '/rooms/{}/'.format(self.room.pk))
+        self.assertEqual(status_code, 200)
+        self.assertEqual(json.loads(content)['capacity'], 1)
+
+
+class WriteBehindTestCase(TransactionTestCase):
+    # The writer thread has its own connection, so the data has to be committed
+    def setUp(self):
+        from .writebehind import WriteBehindQueue
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.room = Room.objects.create(capacity=3)
+        self.movie = Movie.objects.create(title="blah")
+        self.screening = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=10))
+        self.tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        self.queue = WriteBehindQueue(self.directory, block_size=2, interval=0.01)
+        self.addCleanup(self.queue.stop)
+
+    def sold(self):
+        return SeatInventory.objects.get(screening=self.screening, date=self.tomorrow).sold
+
+    def test_grants_are_written_in_the_background(self):
+        self.queue.start()
+        tickets = [self.queue.grant(self.screening, self.tomorrow) for _ in range(4)]
+        self.assertIsNone(tickets.pop())
+        self.assertEqual(self.sold(), 3)
+        self.queue.stop()
+        self.assertEqual(set(Ticket.objects.values_list('receipt', flat=True)), {ticket.receipt for ticket in tickets})
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_unused_seats_are_given_back_on_stop(self):
+        self.queue.start()
+        self.queue.grant(self.screening, self.tomorrow)
+        self.assertEqual(self.sold(), 2)
+        self.queue.stop()
+        self.assertEqual(self.sold(), 1)
+        self.assertEqual(Ticket.objects.count(), 1)
+
+    def test_journals_are_replayed_once(self):
+        from .writebehind import recover
+        entries = [{'receipt': 'c5f1a7b6-8f0c-4b7e-9a1e-3a3c2f0e1d{:02}'.format(number),
+                    'screening': self.screening.pk, 'date': str(self.tomorrow)} for number in range(2)]
+        for _ in range(2):
+            path = os.path.join(self.directory, 'tickets-{}-0.journal'.format(os.getpid()))
+            with open(path, 'w') as journal:
+                journal.write(''.join(json.dumps(entry) + '\n' for entry in entries) + '{"receipt": ')
+            recover(self.directory)
+        self.assertEqual(Ticket.objects.count(), 2)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_tickets_for_deleted_screenings_are_dropped(self):
+        from .writebehind import recover
+        other = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=20))
+        self.queue.start()
+        kept = self.queue.grant(other, self.tomorrow)
+        self.queue.grant(self.screening, self.tomorrow)
+        self.screening.delete()
+        with self.assertLogs('theatre.writebehind', 'WARNING'):
+            self.assertEqual(self.queue.flush(), 1)
+        self.assertEqual(list(Ticket.objects.values_list('receipt', flat=True)), [kept.receipt])
+        self.assertEqual(self.queue.pending, [])
+        # Replaying after a restart drops them too
+        self.queue.stop()
+        path = os.path.join(self.directory, 'tickets-{}-9.journal'.format(os.getpid()))
+        with open(path, 'w') as journal:
+            journal.write(json.dumps({'receipt': 'c5f1a7b6-8f0c-4b7e-9a1e-3a3c2f0e1d00',
+                                      'screening': self.screening.pk, 'date': str(self.tomorrow)}) + '\n')
+        with self.assertLogs('theatre.writebehind', 'WARNING'):
+            self.assertEqual(recover(self.directory), 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(Ticket.objects.count(), 1)
+
+    def test_journals_of_running_processes_are_left_alone(self):
+        from .writebehind import recover
+        path = os.path.join(self.directory, 'tickets-{}-0.journal'.format(os.getppid()))
+        open(path, 'w').close()
+        self.assertEqual(recover(self.directory), 0)
+        self.assertTrue(os.path.exists(path))
+
+    def test_failed_journal_write_keeps_the_seat(self):
+        self.queue.start()
+        self.queue.grant(self.screening, self.tomorrow)
+        with mock.patch('theatre.writebehind.os.fsync', side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.queue.grant(self.screening, self.tomorrow)
+        second = self.queue.grant(self.screening, self.tomorrow)
+        self.queue.stop()
+        self.assertEqual(self.sold(), 2)
+        self.assertEqual(Ticket.objects.count(), 2)
+        self.assertTrue(Ticket.objects.filter(receipt=second.receipt).exists())
+
+    def test_journals_replayed_by_another_process_are_skipped(self):
+        from .writebehind import recover
+        path = os.path.join(self.directory, 'tickets-{}-0.journal'.format(os.getpid()))
+        with mock.patch('theatre.writebehind.glob.glob', return_value=[path]):
+            self.assertEqual(recover(self.directory), 0)
+        with open(path, 'w') as journal:
+            journal.write(json.dumps({'receipt': 'c5f1a7b6-8f0c-4b7e-9a1e-3a3c2f0e1d00',
+                                      'screening': self.screening.pk, 'date': str(self.tomorrow)}) + '\n')
+        with mock.patch('theatre.writebehind.os.remove', side_effect=FileNotFoundError):
+            self.assertEqual(recover(self.directory), 1)
+        self.assertEqual(Ticket.objects.count(), 1)
+
+    def test_queue_is_kept_only_once_started(self):
+        from . import writebehind
+        blocker = os.path.join(self.directory, 'file')
+        open(blocker, 'w').close()
+        with override_settings(TICKET_JOURNAL_DIR=os.path.join(blocker, 'journal')):
+            with self.assertRaises(OSError):
+                writebehind.queue()
+        self.assertIsNone(writebehind._queue)
+
+    def test_buy_ticket_is_accepted(self):
+        from . import writebehind
+        with override_settings(TICKET_WRITE_BEHIND=True, TICKET_JOURNAL_DIR=self.directory):
+            response = self.client.post(reverse('screening-buyticket', args=[self.screening.pk]),
+                                        {'date': self.tomorrow})
+            writebehind.stop()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertIsNone(response.json()['seat'])
+        self.assertEqual(str(Ticket.objects.get().receipt), response.json()['receipt'])
+        self.assertEqual(self.sold(), 1)
+
+    def test_reconcile_inventory(self):
+        self.screening.sell_tickets(self.tomorrow)
+        self.screening.reserve_seats(self.tomorrow, 2)
+        call_command('reconcile_inventory', stdout=io.StringIO())
+        self.assertEqual(self.sold(), 1)
+
+
+class DatabaseProfileTestCase(TestCase):
+    def test_sqlite_pragmas_applied_to_new_connections(self):
+        from .signals import apply_sqlite_pragmas
+        # synchronous can't change inside the test transaction, busy_timeout can
+        with self.settings(SQLITE_PRAGMAS={'busy_timeout': 1234}):
+            apply_sqlite_pragmas(sender=None, connection=connection)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 1234)
+            cursor.execute('PRAGMA busy_timeout = 5000')
+
+
+class ApiSettingsTestCase(TestCase):
+    # The profile has to be picked before Django is set up, so it runs in a new interpreter
+    SCRIPT = """
+import json, django
+django.setup()
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+connection.creation.create_test_db(verbosity=0)
+client = Client()
+responses = [client.post('/rooms/', {'capacity': 3}), client.get('/rooms/', HTTP_ACCEPT='text/html')]
+print(json.dumps({'apps': settings.INSTALLED_APPS, 'statuses': [response.status_code for response in responses],
+                  'types': [response['Content-Type'] for response in responses]}))
+"""
+
+    def test_api_profile_serves_json_only(self):
+        output = subprocess.run([sys.executable, '-c', self.SCRIPT], check=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                universal_newlines=True, cwd=os.path.dirname(os.path.dirname(__file__)),
+                                env=dict(os.environ, DJANGO_SETTINGS_MODULE='challenge.settings_api')).stdout
+        result = json.loads(output.splitlines()[-1])
+        self.assertEqual(result['apps'], ['rest_framework', 'theatre.apps.TheatreConfig'])
+        self.assertEqual(result['statuses'], [201, 406])
+        self.assertEqual(result['types'][0], 'application/json')
+
+
+class MetricsTestCase(APITestCase):
+    def setUp(self):
+        from .metrics import registry
+        registry.clear()
+        cache.clear()
+        self.room = Room.objects.create(capacity=1)
+        self.movie = Movie.objects.create(title="blah")
+        self.screening = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=10))
+
+    def test_server_timing_header(self):
+        response = self.client.get('/screenings/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_query_count_recorded_per_view(self):
+        from .metrics import registry
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/screenings/{}/buyticket/'.format(self.screening.pk), {'date': str(tomorrow)})
+        histogram = registry.histograms['theatre_request_queries'][('screening-buyticket', 'POST')]
+        self.assertEqual(sum(histogram.counts), 1)
+        self.assertEqual(histogram.sum, len(queries))
+
+    def test_prometheus_exposition(self):
+        self.client.get('/rooms/')
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        text = response.content.decode()
+        self.assertIn('# TYPE theatre_request_duration_seconds histogram', text)
+        self.assertIn('theatre_request_queries_count{view="room-list",method="GET"} 1', text)
+        self.assertIn('theatre_request_duration_seconds_bucket{view="room-list",method="GET",le="+Inf"} 1', text)
+
+
+class SeedDataTestCase(TestCase):
+    def test_seeded_data_is_consistent(self):
+        from .seed import seed
+        from django.db.models import Sum
+        start = datetime.date(2030, 1, 1)
+        seed(rooms=3, screenings=20, movies=4, days=2, tickets=100, start=start)
+        self.assertEqual(Screening.objects.count(), 20)
+        self.assertEqual(Ticket.objects.count(), 100)
+        self.assertEqual(SeatInventory.objects.aggregate(sold=Sum('sold'))['sold'], 100)
+        for screening in Screening.objects.all():
+            self.assertFalse(Screening.objects.overlapping(screening).exists())
+        for inventory in SeatInventory.objects.all():
+            self.assertEqual(inventory.sold, Ticket.objects.filter(
+                screening=inventory.screening, date=inventory.date).count())
+            self.assertLess(inventory.sold, inventory.capacity)
+        self.assertEqual(sum(len(schedule.timeline()) for schedule in RoomSchedule.objects.all()), 20)
+
+    def test_command_refuses_existing_data(self):
+        Room.objects.create()
+        with self.assertRaises(CommandError):
+            call_command('seed_data', '--rooms', '1', '--screenings', '1', stdout=io.StringIO())
+
+    def test_command(self):
+        output = io.StringIO()
+        call_command('seed_data', '--rooms', '2', '--screenings', '10', '--movies', '2', '--days', '1',
+                     '--tickets', '30', stdout=output)
+        self.assertIn('Created 2 rooms, 2 movies, 10 screenings and 30 tickets', output.getvalue())
+        self.assertEqual(Ticket.objects.count(), 30)
+
+
+class QueryBudgetTestCase(APITestCase):
+    """Pin the queries and memory each endpoint may use, at several data sizes.
+
+    Query counts must not change with the amount of data, and must stay within
+    the budget. Peak memory allocated while handling the request must stay
+    within its budget at every size, which list endpoints meet by paginating.
+    Responses are never served from the cache here.
+    """
+    SIZES = (1, 5, 25)
+
+    # name: (method, path, data, status, max queries, max KiB allocated). Schedules
+    # touched by a delete are rebuilt on commit, which doesn't happen in a TestCase.
+    BUDGETS = {
+        'room-list': ('get', '/rooms/', None, 200, 1, 128),
+        'room-detail': ('get', '/rooms/{room}/', None, 200, 1, 128),
+        'room-create': ('post', '/rooms/', {'capacity': 10}, 201, 2, 128),
+        'room-update': ('put', '/rooms/{room}/', {'capacity': 5000}, 200, 3, 128),
+        'room-schedule': ('get', '/rooms/{room}/schedule/', None, 200, 1, 128),
+        'room-schedules': ('get', '/rooms/schedules/', None, 200, 1, 768),
+        'room-destroy': ('delete', '/rooms/{room}/', None, 204, 12, 192),
+        'room-export': ('get', '/rooms/export/', None, 200, 1, 128),
+        'room-import': ('post', '/rooms/import/', {'capacity': 10}, 200, 3, 128),
+        'movie-list': ('get', '/movies/', None, 200, 1, 256),
+        'movie-detail': ('get', '/movies/{movie}/', None, 200, 1, 128),
+        'movie-create': ('post', '/movies/', {'title': 'new'}, 201, 1, 128),
+        'movie-update': ('patch', '/movies/{movie}/', {'title': 'renamed'}, 200, 7, 384),
+        'movie-destroy': ('delete', '/movies/{movie}/', None, 204, 10, 192),
+        'movie-export': ('get', '/movies/export/', None, 200, 1, 128),
+        'movie-import': ('post', '/movies/import/', {'title': 'imported', 'length': '01:00:00'}, 200, 1, 128),
+        'screening-list': ('get', '/screenings/', None, 200, 1, 512),
+        'screening-list-expanded': ('get', '/screenings/?expand=1', None, 200, 1, 1024),
+        'screening-detail': ('get', '/screenings/{screening}/', None, 200, 1, 128),
+        'screening-create': ('post', '/screenings/', {'room': '{room}', 'movie': '{short}', 'time': '{gap}'},
+                             201, 9, 256),
+        'screening-create-overlap': ('post', '/screenings/',
+                                     {'room': '{room}', 'movie': '{short}', 'time': '00:00:00'}, 400, 3, 128),
+        'screening-update': ('patch', '/screenings/{screening}/', {'movie': '{short}'}, 200, 9, 192),
+        'screening-destroy': ('delete', '/screenings/{screening}/', None, 204, 8, 128),
+        'screening-buyticket': ('post', '/screenings/{screening}/buyticket/', {'date': '{date}'}, 200, 3, 128),
+        'screening-buyticket-first-of-day': ('post', '/screenings/{screening}/buyticket/', {'date': '{later}'},
+                                             200, 5, 192),
+        'screening-buytickets': ('post', '/screenings/buytickets/',
+                                 {'items': [{'screening': '{screening}', 'date': '{date}', 'quantity': 3}]},
+                                 200, 4, 192),
+        'screening-seats': ('get', '/screenings/{screening}/seats/?date={date}', None, 200, 2, 128),
+        'screening-hold': ('post', '/screenings/{screening}/hold/', {'date': '{date}', 'seats': [0, 1]},
+                           201, 4, 192),
+        'screening-season': ('post', '/screenings/season/',
+                             {'first_date': '{date}', 'last_date': '{later}',
+                              'screenings': [{'room': '{room}', 'movie': '{short}', 'time': '{gap}'}]},
+                             201, 8, 192),
+        'screening-availability': ('get', '/screenings/availability/?start={date}&end={date}', None, 200, 2, 512),
+        'screening-export': ('get', '/screenings/export/', None, 200, 1, 256),
+        'screening-import': ('post', '/screenings/import/', {'room': '{room}', 'movie': '{short}', 'time': '{gap}'},
+                             200, 7, 128),
+        'hold-detail': ('get', '/holds/{hold}/', None, 200, 1, 128),
+        'hold-destroy': ('delete', '/holds/{hold}/', None, 204, 7, 192),
+        'hold-confirm': ('post', '/holds/{hold}/confirm/', None, 200, 5, 128),
+        'report-occupancy': ('get', '/reports/occupancy/?start={date}&end={later}&group=date', None,
+                             200, 3, 128),
+        'ticket-export': ('get', '/tickets/export/?start={date}&end={date}', None, 200, 1, 512),
+    }
+
+    def setUp(self):
+        self.date = datetime.date.today() + datetime.timedelta(days=1)
+        # The first request pays for imports and caches that would skew its allocations
+        self.client.get('/rooms/')
+
+    def seed(self, size):
+        from .seed import seed
+        Ticket.objects.all().delete()
+        Screening.objects.all().delete()
+        Room.objects.all().delete()
+        Movie.objects.all().delete()
+        seed(rooms=size, screenings=size * 8, movies=size, days=2, tickets=size * 20, start=self.date)
+        room = Room.objects.order_by('pk').first()
+        first = Screening.objects.filter(room=room).select_related('movie').order_by('start_offset').first()
+        short = Movie.objects.create(title="short", length=datetime.timedelta(minutes=1))
+        hold = first.hold_seats(self.date, [2])
+        return {
+            'room': room.pk,
+            'movie': first.movie_id,
+            'screening': first.pk,
+            'short': short.pk,
+            'gap': str(time_of_day(first.end_offset)),
+            'date': str(self.date),
+            'later': str(self.date + datetime.timedelta(days=30)),
+            'hold': hold.pk,
+        }
+
+    def fill(self, template, values):
+        if isinstance(template, str):
+            return template.format(**values)
+        if isinstance(template, dict):
+            return {key: self.fill(value, values) for key, value in template.items()}
+        if isinstance(template, list):
+            return [self.fill(value, values) for value in template]
+        return template
+
+    def measure(self, method, path, data, expected_status):
+        cache.clear()
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(path, data, format='json')
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.assertEqual(response.status_code, expected_status, (path, content[:200]))
+        queries = [query['sql'] for query in context.captured_queries if 'SAVEPOINT' not in query['sql']]
+        return len(queries), peak // 1024
+
+    def test_endpoint_budgets(self):
+        measured = collections.defaultdict(dict)
+        for size in self.SIZES:
+            values = self.seed(size)
+            for name, (method, path, data, expected_status, _, _) in self.BUDGETS.items():
+                # Roll back after each request so every endpoint sees the same data
+                savepoint = transaction.savepoint()
+                measured[name][size] = self.measure(method, self.fill(path, values), self.fill(data, values),
+                                                    expected_status)
+                transaction.savepoint_rollback(savepoint)
+        for name, (_, _, _, _, max_queries, max_kib) in self.BUDGETS.items():
+            with self.subTest(endpoint=name):
+                queries = {size: result[0] for size, result in measured[name].items()}
+                self.assertEqual(len(set(queries.values())), 1, "queries grow with data: {}".format(queries))
+                self.assertLessEqual(max(queries.values()), max_queries)
+                for size, (_, kib) in measured[name].items():
+                    self.assertLessEqual(kib, max_kib, "{} KiB allocated with {} rooms".format(kib, size))
+
+
+class SeatHoldTestCase(APITestCase):
+    def setUp(self):
+        self.room = Room.objects.create(capacity=4)
+        self.movie = Movie.objects.create(title="blah")
+        self.screening = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=10))
+        self.date = datetime.date.today() + datetime.timedelta(days=1)
+
+    def hold(self, seats, screening=None):
+        url = reverse('screening-hold', args=[(screening or self.screening).pk])
+        return self.client.post(url, {'date': str(self.date), 'seats': seats}, format='json')
+
+    def seat_map(self):
+        return self.client.get(reverse('screening-seats', args=[self.screening.pk]), {'date': str(self.date)}).data
+
+    def test_hold_takes_seats(self):
+        response = self.hold([2, 0])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['seats'], [0, 2])
+        seat_map = self.seat_map()
+        self.assertEqual((seat_map['taken'], seat_map['remaining']), ([0, 2], 2))
+
+    def test_seat_map_for_unsold_date(self):
+        with self.assertNumQueries(2):
+            seat_map = self.seat_map()
+        self.assertEqual((seat_map['capacity'], seat_map['remaining'], seat_map['taken']), (4, 4, []))
+
+    def test_cannot_hold_taken_or_missing_seats(self):
+        self.hold([1])
+        self.assertEqual(self.hold([1, 2]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.hold([4]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.hold([2, 2]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.hold([2 ** 31 - 2]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.hold([10 ** 100]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.seat_map()['taken'], [1])
+
+    def test_holds_and_unseated_tickets_share_capacity(self):
+        self.hold([0, 1, 2])
+        self.screening.sell_tickets(self.date)
+        with self.assertRaises(SeatsUnavailable):
+            self.screening.sell_tickets(self.date)
+        self.assertEqual(self.hold([3]).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_confirm(self):
+        hold = self.hold([1, 3]).data
+        response = self.client.post(reverse('seathold-confirm', args=[hold['id']]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([ticket['seat'] for ticket in response.data], [1, 3])
+        self.assertEqual(Ticket.objects.filter(screening=self.screening, date=self.date).count(), 2)
+        self.assertEqual(self.seat_map()['taken'], [1, 3])
+        response = self.client.post(reverse('seathold-confirm', args=[hold['id']]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_release(self):
+        hold = self.hold([0, 1]).data
+        response = self.client.delete(reverse('seathold-detail', args=[hold['id']]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual((self.seat_map()['taken'], self.seat_map()['remaining']), ([], 4))
+
+    def test_deleting_seated_ticket_frees_seat(self):
+        hold = SeatHold.objects.get(pk=self.hold([2]).data['id'])
+        ticket, = hold.confirm()
+        ticket.delete()
+        self.assertEqual((self.seat_map()['taken'], self.seat_map()['remaining']), ([], 4))
+
+    def test_expired_hold(self):
+        hold = SeatHold.objects.get(pk=self.hold([0]).data['id'])
+        later = hold.expires_at + datetime.timedelta(seconds=1)
+        with self.assertRaises(HoldExpired):
+            hold.confirm(now=later)
+        # Still taken until the sweeper runs
+        self.assertEqual(self.seat_map()['taken'], [0])
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            output = io.StringIO()
+            call_command('release_expired_holds', stdout=output)
+        self.assertIn('Released 1 expired holds', output.getvalue())
+        self.assertEqual((self.seat_map()['taken'], self.seat_map()['remaining']), ([], 4))
+        self.assertFalse(SeatHold.objects.exists())
+
+    def test_sweep_queries_do_not_grow_with_holds(self):
+        other = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=14))
+        self.hold([0])
+        with CaptureQueriesContext(connection) as few:
+            SeatHold.objects.release()
+        for seat in range(4):
+            self.hold([seat])
+            self.hold([seat], screening=other)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(SeatHold.objects.release(), 8)
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+        self.assertFalse(SeatInventory.objects.filter(sold__gt=0).exists())
+
+    def test_concurrent_seat_map_change_is_retried(self):
+        self.hold([0])
+        inventory = SeatInventory.objects.get()
+        original = SeatInventory.taken
+
+        def change_underneath(self):
+            # Someone else holds seat 1 between our read and write, once
+            if not SeatInventory.objects.filter(version__gt=1).exists():
+                SeatInventory.objects.filter(pk=inventory.pk).update(
+                    seats=bytes([0b11]), sold=2, version=models.F('version') + 1)
+            return original(self)
+
+        with mock.patch.object(SeatInventory, 'taken', change_underneath):
+            self.assertEqual(self.hold([1]).status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(self.hold([2]).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.seat_map()['taken'], [0, 1, 2])
+
+
+class IdempotencyTestCase(APITestCase):
+    def setUp(self):
+        caches['idempotency'].clear()
+        self.room = Room.objects.create(capacity=2)
+        self.movie = Movie.objects.create(title="blah")
+        self.screening = Screening.objects.create(room=self.room, movie=self.movie, time=datetime.time(hour=10))
+        self.date = datetime.date.today() + datetime.timedelta(days=1)
+        self.url = reverse('screening-buyticket', args=[self.screening.pk])
+
+    def buy(self, key, date=None):
+        return self.client.post(self.url, {'date': str(date or self.date)}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_original_ticket(self):
+        first = self.buy('abc')
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.buy('abc')
+        # Only the stored response is read, the view doesn't run
+        self.assertEqual([query['sql'] for query in queries.captured_queries
+                          if 'theatre_idempotency' not in query['sql']], [])
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Ticket.objects.count(), 1)
+        self.assertEqual(SeatInventory.objects.get().sold, 1)
+
+    def test_key_refused_without_shared_store(self):
+        local = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        with override_settings(CACHES={'default': local, 'idempotency': local}):
+            response = self.buy('abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Ticket.objects.count(), 0)
+
+    def test_different_keys_buy_separately(self):
+        self.buy('abc')
+        self.buy('def')
+        self.assertEqual(Ticket.objects.count(), 2)
+        self.client.post(self.url, {'date': str(self.date)}, format='json')
+        self.assertEqual(Ticket.objects.count(), 2)
+
+    def test_key_reused_for_different_request(self):
+        self.buy('abc')
+        response = self.buy('abc', date=self.date + datetime.timedelta(days=1))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Ticket.objects.count(), 1)
+
+    def test_retry_while_first_request_is_running(self):
+        from .idempotency import claim, store_key, fingerprint
+        body = json.dumps({'date': str(self.date)}).encode()
+        claim(store_key('POST', self.url, 'abc'), fingerprint(body))
+        response = self.client.post(self.url, body, content_type='application/json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Ticket.objects.count(), 0)
+
+    def test_rejections_are_replayed(self):
+        self.buy('a')
+        self.buy('b')
+        sold_out = self.buy('c')
+        Ticket.objects.first().delete()
+        self.assertEqual(sold_out.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.buy('c').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.buy('d').status_code, status.HTTP_200_OK)
+
+    def test_server_errors_are_not_stored(self):
+        with mock.patch('theatre.views.purchase_ticket', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.buy('abc')
+        self.assertEqual(self.buy('abc').status_code, status.HTTP_200_OK)
+
+    def test_bad_key(self):
+        self.assertEqual(self.buy('').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.buy('x' * 256).status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,47 +1,252 @@
-from theatre.models import Room, Movie, Screening, Ticket
-from theatre.serializers import RoomSerializer, MovieSerializer, ScreeningSerializer, TicketSerializer
-from rest_framework import viewsets, status
+from theatre import catalog, reports, writebehind
+from theatre.cache import CachedResponseMixin
+from theatre.formats import FORMATS, CONTENT_TYPES
+from theatre.models import Room, Movie, Screening, Ticket, SeatsUnavailable, RoomSchedule, SeatHold, HoldExpired
+from theatre.serializers import RoomSerializer, MovieSerializer, ScreeningSerializer, TicketSerializer, \
+    TicketOrderSerializer, AvailabilityQuerySerializer, ExpandedScreeningSerializer, RoomScheduleSerializer, \
+    TicketExportQuerySerializer, SeatHoldSerializer, SeatHoldRequestSerializer, SeasonSerializer, \
+    ScreeningRuleSerializer, OccupancyQuerySerializer, QueuedTicketSerializer, ValuesSerializer
+from theatre.settlement import export_tickets
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
-from django.http import HttpResponseBadRequest
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+import collections
 import datetime
 
 
-class RoomViewSet(viewsets.ModelViewSet):
+class CatalogTransferMixin:
+    # Bulk import and streaming export of the whole table as NDJSON or CSV. The
+    # viewset's cache_namespace doubles as the kind of record in theatre.catalog.
+    @action(methods=['POST'], detail=False, url_path='import', url_name='import')
+    def import_records(self, request, *args, **kwargs):
+        format = 'csv' if request.content_type.startswith(CONTENT_TYPES['csv']) else 'ndjson'
+        lines = (line.decode('utf-8') for line in request.stream or [])
+        try:
+            imported = catalog.import_catalog(self.cache_namespace, lines, format)
+        except catalog.CatalogError as error:
+            return Response({'errors': error.errors}, status=status.HTTP_400_BAD_REQUEST)
+        except UnicodeDecodeError:
+            return HttpResponseBadRequest("Records must be UTF-8 encoded")
+        return Response({'imported': imported})
+
+    @action(methods=['GET'], detail=False, url_path='export', url_name='export')
+    def export_records(self, request, *args, **kwargs):
+        # Not ?format=, DRF uses that to pick a renderer
+        format = request.query_params.get('output', 'ndjson')
+        if format not in FORMATS:
+            return HttpResponseBadRequest("output must be one of {}".format(', '.join(FORMATS)))
+        response = StreamingHttpResponse(catalog.export_catalog(self.cache_namespace, format),
+                                         content_type=CONTENT_TYPES[format])
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(self.cache_namespace, format)
+        return response
+
+
+class ValuesListMixin:
+    # Plain list GETs are built from .values() rows by a ValuesSerializer, which
+    # skips the per-field work of the viewset's ModelSerializer
+    def list(self, request, *args, **kwargs):
+        if self.get_serializer_class() is not self.serializer_class:
+            return super().list(request, *args, **kwargs)
+        fields = request.query_params.get('fields')
+        serializer = ValuesSerializer(self.serializer_class, fields=fields.split(',') if fields else None)
+        page = self.paginate_queryset(serializer.rows(self.filter_queryset(self.get_queryset())))
+        return self.get_paginated_response(serializer.to_representation(page))
+
+
+class RoomViewSet(CatalogTransferMixin, CachedResponseMixin, ValuesListMixin, viewsets.ModelViewSet):
+    cache_namespace = 'rooms'
     queryset = Room.objects.all()
     serializer_class = RoomSerializer
 
+    def schedule_context(self):
+        # ?date= narrows the timeline to the screenings running that day
+        if 'date' not in self.request.query_params:
+            return {}
+        date = parse_date(self.request.query_params['date'])
+        if date is None:
+            raise ValueError
+        return {'date': date}
+
+    @action(methods=['GET'], detail=True)
+    def schedule(self, request, *args, **kwargs):
+        try:
+            context = self.schedule_context()
+        except ValueError:
+            return HttpResponseBadRequest("Improper format for requested date")
+        schedule = get_object_or_404(RoomSchedule.objects.all(), room=self.kwargs['pk'])
+        return Response(RoomScheduleSerializer(schedule, context=context).data)
 
-class MovieViewSet(viewsets.ModelViewSet):
+    @action(methods=['GET'], detail=False)
+    def schedules(self, request, *args, **kwargs):
+        try:
+            context = self.schedule_context()
+        except ValueError:
+            return HttpResponseBadRequest("Improper format for requested date")
+        page = self.paginate_queryset(RoomSchedule.objects.all())
+        return self.get_paginated_response(RoomScheduleSerializer(page, many=True, context=context).data)
+
+
+class MovieViewSet(CatalogTransferMixin, CachedResponseMixin, ValuesListMixin, viewsets.ModelViewSet):
+    cache_namespace = 'movies'
     queryset = Movie.objects.all()
     serializer_class = MovieSerializer
 
 
 def overlap_exists(proposed_screening):
-    for screening in Screening.objects.all():
-        if proposed_screening.overlaps(screening):
-            return True
-    return False
+    return bool(Screening.objects.conflicting(proposed_screening))
+
+
+def requested_date(data):
+    # Tickets are for today unless the request names a date
+    if 'date' not in data:
+        return datetime.date.today()
+    return datetime.datetime.strptime(data['date'], "%Y-%m-%d").date()
+
 
+def purchase_ticket(screening, date):
+    # Returns None when the screening doesn't run that day, has already begun or is sold out
+    if not screening.runs_on(date) or screening.has_started(date):
+        return None
+    if settings.TICKET_WRITE_BEHIND:
+        return writebehind.queue().grant(screening, date)
+    ticket = Ticket(screening=screening, date=date)
+    try:
+        ticket.save()
+    except SeatsUnavailable:
+        return None
+    return ticket
 
-class ScreeningViewSet(viewsets.ModelViewSet):
+
+def sold_ticket(ticket):
+    # Returns the status and body for a ticket from purchase_ticket
+    if ticket.pk is None:
+        return status.HTTP_202_ACCEPTED, QueuedTicketSerializer(ticket).data
+    return status.HTTP_200_OK, TicketSerializer(ticket).data
+
+
+def screening_availability(screenings, query):
+    if 'screening' in query:
+        screenings = screenings.filter(pk__in=query['screening'])
+    if 'room' in query:
+        screenings = screenings.filter(room=query['room'])
+    if 'movie' in query:
+        screenings = screenings.filter(movie=query['movie'])
+    return screenings.availability(query['start'], query['end'])
+
+
+class ScreeningViewSet(CatalogTransferMixin, CachedResponseMixin, ValuesListMixin, viewsets.ModelViewSet):
+    cache_namespace = 'screenings'
     queryset = Screening.objects.all()
     serializer_class = ScreeningSerializer
 
+    def expand(self):
+        return self.action in ('list', 'retrieve') and self.request.query_params.get('expand') in ('1', 'true')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.expand():
+            queryset = queryset.select_related('room', 'movie')
+        elif self.action in ('buy_ticket', 'seats', 'hold'):
+            # The room's capacity is needed for the first sale of each date, the rule to check the date
+            queryset = queryset.select_related('room', 'rule')
+        return queryset
+
+    def get_serializer_class(self):
+        if self.expand():
+            return ExpandedScreeningSerializer
+        return super().get_serializer_class()
+
     @action(methods=['POST'], detail=True, url_path='buyticket', url_name='buyticket')
     def buy_ticket(self, request, *args, **kwargs):
-        proposed_date = datetime.date.today()
-        if 'date' in request.data:
-            try:
-                proposed_date = datetime.datetime.strptime(request.data['date'], "%Y-%m-%d")
-            except ValueError:
-                return HttpResponseBadRequest("Improper format for requested date")
-        if self.get_object().are_seats_remaining(proposed_date):
-            ticket = Ticket(screening=self.get_object(), date=proposed_date)
-            ticket.save()
-            return Response(TicketSerializer(ticket).data)
-        else:
+        try:
+            proposed_date = requested_date(request.data)
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest("Improper format for requested date")
+        ticket = purchase_ticket(self.get_object(), proposed_date)
+        if ticket is None:
             return HttpResponseBadRequest("Unable to purchase ticket for specified screening")
+        response_status, data = sold_ticket(ticket)
+        return Response(data, status=response_status)
+
+    @action(methods=['GET'], detail=True)
+    def seats(self, request, *args, **kwargs):
+        try:
+            date = requested_date(request.query_params)
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest("Improper format for requested date")
+        return Response(self.get_object().seat_map(date))
+
+    @action(methods=['POST'], detail=True)
+    def hold(self, request, *args, **kwargs):
+        serializer = SeatHoldRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        screening = self.get_object()
+        date = serializer.validated_data['date']
+        if not screening.runs_on(date) or screening.has_started(date):
+            return HttpResponseBadRequest("Unable to hold seats for specified screening")
+        try:
+            hold = screening.hold_seats(date, serializer.validated_data['seats'])
+        except SeatsUnavailable:
+            return HttpResponseBadRequest("Unable to hold seats for specified screening")
+        return Response(SeatHoldSerializer(hold).data, status=status.HTTP_201_CREATED)
+
+    @action(methods=['POST'], detail=False, url_path='buytickets', url_name='buytickets')
+    def buy_tickets(self, request, *args, **kwargs):
+        if isinstance(request.data, list):
+            items = request.data
+        elif isinstance(request.data, dict):
+            items = request.data.get('items')
+        else:
+            return HttpResponseBadRequest("Send a list of items, or an object with items")
+        serializer = TicketOrderSerializer(data=items, many=True)
+        serializer.is_valid(raise_exception=True)
+        # Combine items for the same screening and date so each is checked against capacity once
+        orders = collections.OrderedDict()
+        for item in serializer.validated_data:
+            key = (item['screening'], item['date'])
+            orders[key] = orders.get(key, 0) + item['quantity']
+
+        screenings = Screening.objects.select_related('room', 'rule').in_bulk({screening for screening, _ in orders})
+        for screening_id, date in orders:
+            screening = screenings.get(screening_id)
+            if screening is None:
+                return HttpResponseBadRequest("Unknown screening {}".format(screening_id))
+            if not screening.runs_on(date) or screening.has_started(date):
+                return HttpResponseBadRequest("Unable to purchase tickets for specified screenings")
+
+        tickets = []
+        try:
+            # All or nothing: one sold out screening rolls back the whole order
+            with transaction.atomic():
+                for (screening_id, date), quantity in orders.items():
+                    tickets.extend(screenings[screening_id].sell_tickets(date, quantity))
+        except SeatsUnavailable:
+            return HttpResponseBadRequest("Unable to purchase tickets for specified screenings")
+        return Response(TicketSerializer(tickets, many=True).data)
+
+    @action(methods=['POST'], detail=False)
+    def season(self, request, *args, **kwargs):
+        serializer = SeasonSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            rule = catalog.create_season(data['first_date'], data['last_date'], data['weekdays'],
+                                         data['screenings'])
+        except catalog.CatalogError as error:
+            return Response({'errors': error.errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'rule': ScreeningRuleSerializer(rule).data, 'created': len(data['screenings'])},
+                        status=status.HTTP_201_CREATED)
+
+    @action(methods=['GET'], detail=False)
+    def availability(self, request, *args, **kwargs):
+        serializer = AvailabilityQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(screening_availability(self.get_queryset(), serializer.validated_data))
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -51,3 +256,46 @@ class ScreeningViewSet(viewsets.ModelViewSet):
             return HttpResponseBadRequest("Overlaps existing screening")
         return super(ScreeningViewSet, self).create(request, args, kwargs)
 
+
+class TicketViewSet(viewsets.GenericViewSet):
+    queryset = Ticket.objects.all()
+    serializer_class = TicketSerializer
+
+    @action(methods=['GET'], detail=False, url_path='export', url_name='export')
+    def export_records(self, request, *args, **kwargs):
+        serializer = TicketExportQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+        response = StreamingHttpResponse(export_tickets(query['start'], query['end'], query['output']),
+                                         content_type=CONTENT_TYPES[query['output']])
+        response['Content-Disposition'] = 'attachment; filename="tickets-{}-{}.{}"'.format(
+            query['start'], query['end'], query['output'])
+        return response
+
+
+class ReportViewSet(viewsets.ViewSet):
+    @action(methods=['GET'], detail=False)
+    def occupancy(self, request, *args, **kwargs):
+        serializer = OccupancyQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+        return Response(reports.occupancy(query['start'], query['end'], query['group'],
+                                          room=query.get('room'), movie=query.get('movie')))
+
+
+class HoldViewSet(mixins.RetrieveModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    # Holds are created per screening, see ScreeningViewSet.hold. Deleting one
+    # gives its seats back, confirming it turns them into tickets.
+    queryset = SeatHold.objects.all()
+    serializer_class = SeatHoldSerializer
+
+    def perform_destroy(self, instance):
+        SeatHold.objects.filter(pk=instance.pk).release()
+
+    @action(methods=['POST'], detail=True)
+    def confirm(self, request, *args, **kwargs):
+        try:
+            tickets = self.get_object().confirm()
+        except HoldExpired:
+            return HttpResponseBadRequest("Hold has expired")
+        return Response(TicketSerializer(tickets, many=True).data)
@@ -0,0 +1,242 @@
+"""Grant tickets from memory and write them to the database in batches.
+
+Enabled by the TICKET_WRITE_BEHIND setting. Each process claims seats from a
+screening's inventory counter a block at a time and hands them out without
+touching the database, so a purchase costs one journal append instead of a
+write transaction. A background thread inserts the granted tickets in batches.
+
+Every grant is appended to a journal file and synced before it is returned, so
+a ticket that was given out survives a crash. A process replays journals left
+behind by processes that are no longer running when it starts. Tickets carry a
+receipt, so replaying one that was already written is a no-op. Stopping the
+queue writes what is pending and gives unused seats back to the inventory.
+A crashed process can't give its unused seats back; they stay sold until
+``manage.py reconcile_inventory`` recounts them.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.utils.dateparse import parse_date
+
+from .models import Screening, Ticket
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_NAME = 'tickets-{pid}-{segment}.journal'
+
+
+def process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def insert(tickets, batch_size=500):
+    """Write tickets, dropping those whose screening was deleted after they were granted.
+
+    Returns how many were kept.
+    """
+    screenings = set()
+    ids = sorted({ticket.screening_id for ticket in tickets})
+    for start in range(0, len(ids), batch_size):
+        screenings.update(Screening.objects.filter(pk__in=ids[start:start + batch_size]).values_list('pk', flat=True))
+    orphans = [ticket for ticket in tickets if ticket.screening_id not in screenings]
+    if orphans:
+        logger.warning("Dropping %d tickets for deleted screenings: %s", len(orphans),
+                       ', '.join(str(ticket.receipt) for ticket in orphans))
+    Ticket.objects.bulk_create([ticket for ticket in tickets if ticket.screening_id in screenings],
+                               batch_size=batch_size, ignore_conflicts=True)
+    return len(tickets) - len(orphans)
+
+
+def recover(directory, batch_size=500):
+    """Write the tickets in journals left by processes that are no longer running.
+
+    Returns how many journal entries were replayed.
+    """
+    replayed = 0
+    for path in sorted(glob.glob(os.path.join(directory, JOURNAL_NAME.format(pid='*', segment='*')))):
+        pid = int(os.path.basename(path).split('-')[1])
+        if pid != os.getpid() and process_running(pid):
+            continue
+        tickets = []
+        try:
+            with open(path) as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn by a crash mid-append, so that grant was never returned
+                        break
+                    tickets.append(Ticket(screening_id=entry['screening'], date=parse_date(entry['date']),
+                                          receipt=entry['receipt']))
+        except FileNotFoundError:
+            # Another process starting up replayed it first
+            continue
+        insert(tickets, batch_size)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        replayed += len(tickets)
+    return replayed
+
+
+class WriteBehindQueue:
+    def __init__(self, directory, block_size=20, batch_size=500, interval=0.05, fsync=True):
+        self.directory = directory
+        self.block_size = block_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        # Seats claimed from the inventory but not granted yet, per (screening id, date)
+        self.reserved = {}
+        self.pending = []
+        # Finished journal segments whose tickets are all in pending
+        self.segments = []
+        self.segment = 0
+        self.journal = None
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+    def path(self, segment):
+        return os.path.join(self.directory, JOURNAL_NAME.format(pid=os.getpid(), segment=segment))
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        replayed = recover(self.directory, self.batch_size)
+        if replayed:
+            logger.warning("Replayed %d journaled tickets", replayed)
+        self.journal = open(self.path(self.segment), 'a')
+        self.thread = threading.Thread(target=self.run, name='ticket-writer', daemon=True)
+        self.thread.start()
+
+    def grant(self, screening, date):
+        """An unsaved ticket for screening on date, or None if it is sold out.
+
+        The ticket is journaled before it is returned and written by the background
+        thread later. Only claiming a new block of seats touches the database.
+        """
+        key = (screening.pk, date)
+        with self.lock:
+            if not self.reserved.get(key):
+                self.reserved[key] = screening.reserve_up_to(date, self.block_size)
+                if not self.reserved[key]:
+                    return None
+            ticket = Ticket(screening=screening, date=date, receipt=uuid.uuid4())
+            self.append(ticket)
+            # Only a journaled grant takes the seat, otherwise it stays for the next buyer
+            self.reserved[key] -= 1
+            self.pending.append(ticket)
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.wake.set()
+        return ticket
+
+    def append(self, ticket):
+        position = self.journal.tell()
+        try:
+            self.journal.write(json.dumps({'receipt': str(ticket.receipt), 'screening': ticket.screening_id,
+                                           'date': str(ticket.date)}) + '\n')
+            self.journal.flush()
+            if self.fsync:
+                os.fsync(self.journal.fileno())
+        except OSError:
+            # Don't leave a torn line for later entries to follow, recovery stops at one
+            try:
+                self.journal.truncate(position)
+            except OSError:
+                pass
+            raise
+
+    def flush(self):
+        """Write the pending tickets, returning how many were written."""
+        with self.lock:
+            if not self.pending:
+                return 0
+            batch, self.pending = self.pending, []
+            # Move on to a new segment, so the ones holding this batch can go once it's written
+            self.journal.close()
+            segments, self.segments = self.segments + [self.path(self.segment)], []
+            self.segment += 1
+            self.journal = open(self.path(self.segment), 'a')
+        try:
+            written = insert(batch, self.batch_size)
+        except Exception:
+            # Try again next time, the journal still has them
+            with self.lock:
+                self.pending[:0] = batch
+                self.segments[:0] = segments
+            raise
+        for segment in segments:
+            os.remove(segment)
+        return written
+
+    def run(self):
+        try:
+            while not self.stopping:
+                self.wake.wait(self.interval)
+                self.wake.clear()
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Writing granted tickets failed, retrying")
+            self.flush()
+        finally:
+            connection.close()
+
+    def stop(self):
+        """Write every pending ticket and give unused seats back to the inventory."""
+        if self.thread is None:
+            return
+        self.stopping = True
+        self.wake.set()
+        self.thread.join()
+        self.thread = None
+        with self.lock:
+            for (screening, date), unused in self.reserved.items():
+                if unused:
+                    Screening(pk=screening).release_seats(date, unused)
+            self.reserved.clear()
+            self.journal.close()
+            if not self.pending:
+                os.remove(self.path(self.segment))
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def queue():
+    """This process's queue, started on first use."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            started = WriteBehindQueue(settings.TICKET_JOURNAL_DIR, **settings.TICKET_WRITE_BEHIND_OPTIONS)
+            # Only a queue that started is kept, a failed start is tried again next time
+            started.start()
+            _queue = started
+        return _queue
+
+
+@atexit.register
+def stop():
+    """Drain and stop this process's queue, if it was started."""
+    global _queue
+    with _queue_lock:
+        if _queue is not None:
+            _queue.stop()
+            _queue = None